@@ -9,6 +9,8 @@
         - Add sync flag to calendar events
         - Manual sync action on medical patients
         - Day-wise consolidation of appointments
+        - Scheduled incremental sync following edits and cancellations of events
+        - Consolidated invoicing, optionally one invoice per week or month
     """,
     'author': 'Your Company',
     'website': 'https://www.yourcompany.com',
@@ -20,8 +22,10 @@
     'data': [
         'security/ir.model.access.csv',
         'data/sequence_data.xml',
+        'data/ir_cron_data.xml',
         'views/therapy_type_views.xml',
         'views/medical_patient_views.xml',
+        'views/res_config_settings_views.xml',
     ],
     'installable': True,
     'application': False,
@@ -1,4 +1,6 @@
 from . import calendar_event
+from . import medical_appointment
 from . import medical_patient
 from . import therapy_type
-
+from . import medical_invoice_job
+from . import res_config_settings
@@ -1,4 +1,17 @@
-from odoo import models, fields, api
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import models, fields, api, Command, _
+from odoo.tools import split_every
+from odoo.tools.sql import create_index
+
+from odoo.addons.basic_hms.model.medical_action_profile import profiled
+
+# The sync watermark is the start time of the previous run's transaction.
+# Events saved by transactions still open at that time get an older
+# write_date, so every run rescans this window (syncing is idempotent).
+SYNC_OVERLAP = timedelta(minutes=5)
+SYNC_WATERMARK_PARAM = 'appointment_integration.calendar_sync_watermark'
 
 
 class CalendarEvent(models.Model):
@@ -10,6 +23,186 @@ class CalendarEvent(models.Model):
         default=False,
         help='Indicates if this calendar event has been synchronized to create a medical appointment'
     )
+    medical_appointment_ids = fields.Many2many(
+        'medical.appointment', 'medical_appointment_calendar_event_rel', 'event_id', 'appointment_id',
+        string='Medical Appointments',
+        copy=False,
+        readonly=True,
+        help='Medical appointments this calendar event has been synchronized to'
+    )
+
+    def init(self):
+        super().init()
+        # Unsynced events scanned by the manual sync actions and the first cron
+        # run; the predicate is the SQL of the ('...', '=', False) domain
+        create_index(self.env.cr, 'calendar_event_medical_unsynced_start_index', self._table,
+                     ['start'], where='is_computed_as_medical_appointment IS NULL'
+                                      ' OR NOT is_computed_as_medical_appointment')
+        # Watermark scan of the incremental sync
+        create_index(self.env.cr, 'calendar_event_write_date_index', self._table, ['write_date'])
+
+    def unlink(self):
+        self.filtered('medical_appointment_ids')._sync_medical_appointments(removed=True)
+        return super().unlink()
+
+    @api.model
+    @profiled()
+    def _cron_sync_medical_appointments(self):
+        """Sync the calendar events changed or started since the previous run"""
+        params = self.env['ir.config_parameter'].sudo()
+        now = self.env.cr.now()
+        watermark = params.get_param(SYNC_WATERMARK_PARAM)
+        if watermark:
+            since = fields.Datetime.to_datetime(watermark) - SYNC_OVERLAP
+            domain = ['|', ('write_date', '>', since),
+                      '&', ('start', '>', since), ('start', '<=', now)]
+        else:
+            domain = [('is_computed_as_medical_appointment', '=', False), ('start', '<=', now)]
+        # Archived events are cancellations to propagate
+        events = self.with_context(active_test=False)
+        for event_ids in split_every(500, events.search(domain, order='id').ids):
+            events.browse(event_ids)._sync_medical_appointments(cutoff=now)
+        params.set_param(SYNC_WATERMARK_PARAM, fields.Datetime.to_string(now))
+
+    def _get_medical_sync_date(self):
+        """Return the day of the event in the timezone of its organizer"""
+        self.ensure_one()
+        if self.allday:
+            return self.start_date
+        tz = self.user_id.tz or self.env.user.tz or 'UTC'
+        return fields.Datetime.context_timestamp(self.with_context(tz=tz), self.start).date()
+
+    def _get_medical_sync_keys(self, patients_by_partner, cutoff):
+        """Return the set of (patient id, day) the event should be synced to"""
+        self.ensure_one()
+        if not self.active or not self.start or self.start > cutoff:
+            return set()
+        declined = self.attendee_ids.filtered(lambda attendee: attendee.state == 'declined').partner_id
+        day = self._get_medical_sync_date()
+        return {(patients_by_partner[partner.id], day)
+                for partner in self.partner_ids - declined if partner.id in patients_by_partner}
+
+    def _sync_medical_appointments(self, cutoff=None, removed=False):
+        """Bring the medical appointments linked to the events in line with them.
+
+        Every event is linked to one appointment per patient attendee and
+        local day. A pending, not invoiced appointment of the same patient
+        and day is reused when there is one, so syncing an event twice
+        changes nothing. Appointments created by the sync follow the edits
+        of their events and are deleted with their last event while they are
+        pending and not invoiced; other appointments only gain therapies.
+        Returns the created appointments.
+        """
+        # Synced appointments are bulk-ingested: one summary note per patient
+        # instead of per-visit creation logs and tracking
+        Appointment = self.env['medical.appointment'].with_context(medical_bulk_ingest=_('the calendar sync'))
+        Patient = self.env['medical.patient']
+        if cutoff is None:
+            cutoff = fields.Datetime.now()
+        patients = Patient.search([('patient_id', 'in', self.partner_ids.ids)])
+        patients_by_partner = {patient.patient_id.id: patient.id for patient in patients}
+
+        therapy_map = Patient._get_resource_therapy_map()
+        therapy_names = {therapy.id: therapy.name
+                         for therapy in self.env['therapy.type'].browse(set(therapy_map.values()))}
+
+        def get_key(appointment):
+            return appointment.patient_id.id, appointment.attendance_date
+
+        def get_content(events):
+            """Return the therapy ids and the comments of the given events"""
+            therapy_ids, lines = [], []
+            for event in events.sorted(lambda event: (event.start, event.id)):
+                lines.append(f"Calendar Event: {event.name}")
+                event_therapy_ids = Patient._get_therapy_ids_from_event(event, therapy_map)
+                if event_therapy_ids:
+                    therapy_ids.extend(event_therapy_ids)
+                    lines.append(f"Therapies: {', '.join(therapy_names[therapy_id] for therapy_id in event_therapy_ids)}")
+                else:
+                    lines.append("No specific therapy identified")
+            return list(dict.fromkeys(therapy_ids)), '\n'.join(lines)
+
+        # Compare the wanted (patient, day) of every event with its links
+        wanted = {}
+        additions = defaultdict(self.browse)
+        removals = defaultdict(self.browse)
+        kept = Appointment
+        for event in self:
+            wanted[event] = set() if removed else event._get_medical_sync_keys(patients_by_partner, cutoff)
+            linked = {}
+            for appointment in event.medical_appointment_ids:
+                linked[get_key(appointment)] = appointment
+                if get_key(appointment) in wanted[event]:
+                    kept |= appointment
+                else:
+                    removals[appointment] |= event
+            for key in wanted[event] - linked.keys():
+                additions[key] |= event
+
+        # Merge into the appointment of the same patient and day, if any
+        merged = {}
+        if additions:
+            candidates = Appointment.search([
+                ('patient_id', 'in', list({patient_id for patient_id, day in additions})),
+                ('attendance_date', 'in', list({day for patient_id, day in additions})),
+                ('state', '=', 'pending'),
+                ('is_invoiced', '=', False),
+            ], order='is_from_calendar desc, id')
+            for appointment in candidates:
+                key = get_key(appointment)
+                if key in additions and key not in merged:
+                    merged[key] = appointment
+
+        vals_list = []
+        for (patient_id, day), events in additions.items():
+            if (patient_id, day) in merged:
+                continue
+            therapy_ids, comments = get_content(events)
+            vals_list.append({
+                'patient_id': patient_id,
+                'appointment_date': day,
+                'state': 'pending',
+                'is_from_calendar': True,
+                'calendar_event_ids': [Command.set(events.ids)],
+                'therapy_ids': [Command.set(therapy_ids)],
+                'comments': comments,
+            })
+        created = Appointment.create(vals_list)
+
+        to_delete = Appointment
+        added_by_appointment = {appointment: additions[key] for key, appointment in merged.items()}
+        for appointment in kept | Appointment.concat(*removals) | Appointment.concat(*merged.values()):
+            added = added_by_appointment.get(appointment, self.browse())
+            dropped = removals.get(appointment, self.browse())
+            vals = {}
+            if added or dropped:
+                vals['calendar_event_ids'] = [Command.link(event.id) for event in added] + \
+                                             [Command.unlink(event.id) for event in dropped]
+            if appointment.is_from_calendar and appointment.state == 'pending' and not appointment.is_invoiced:
+                events = appointment.with_context(active_test=False).calendar_event_ids - dropped | added
+                if not events:
+                    to_delete |= appointment
+                    continue
+                therapy_ids, comments = get_content(events)
+                if set(therapy_ids) != set(appointment.therapy_ids.ids):
+                    vals['therapy_ids'] = [Command.set(therapy_ids)]
+                if comments != (appointment.comments or ''):
+                    vals['comments'] = comments
+            elif added:
+                therapy_ids, comments = get_content(added)
+                vals['therapy_ids'] = [Command.link(therapy_id) for therapy_id in therapy_ids]
+                vals['comments'] = '\n'.join(filter(None, [appointment.comments, comments]))
+            if vals:
+                appointment.with_context(tracking_disable=True).write(vals)
+        to_delete.unlink()
+
+        if not removed:
+            synced = self.filtered(lambda event: wanted[event])
+            synced.filtered(lambda event: not event.is_computed_as_medical_appointment).write(
+                {'is_computed_as_medical_appointment': True})
+            (self - synced).filtered('is_computed_as_medical_appointment').write(
+                {'is_computed_as_medical_appointment': False})
+        return created
 
     @api.onchange('partner_ids', 'resource_ids')
     def _onchange_partner_resource_name(self):
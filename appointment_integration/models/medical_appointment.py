@@ -0,0 +1,19 @@
+from odoo import models, fields
+
+
+class MedicalAppointment(models.Model):
+    _inherit = 'medical.appointment'
+
+    # Link to the calendar events synchronized into this appointment
+    calendar_event_ids = fields.Many2many(
+        'calendar.event', 'medical_appointment_calendar_event_rel', 'appointment_id', 'event_id',
+        string='Calendar Events',
+        copy=False,
+        readonly=True
+    )
+    is_from_calendar = fields.Boolean(
+        string='Created from Calendar',
+        copy=False,
+        readonly=True,
+        help='Created by the calendar sync: its therapies and info follow the linked calendar events'
+    )
@@ -0,0 +1,14 @@
+from odoo import models, fields
+
+
+class MedicalInvoiceJob(models.Model):
+    _inherit = 'medical.invoice.job'
+
+    job_type = fields.Selection(
+        selection_add=[('consolidated_invoice', 'Consolidated Invoices')],
+        ondelete={'consolidated_invoice': 'cascade'},
+    )
+
+    def _run_consolidated_invoice(self, patients):
+        """Return (invoices, {patient id: error}) for the given chunk."""
+        return patients._create_consolidated_invoices()
@@ -1,10 +1,20 @@
-from odoo import models, fields, api, _
+from markupsafe import Markup
+
+from odoo import models, fields, api, Command, _
 from odoo.exceptions import UserError
+from odoo.tools import SQL, date_utils, format_amount, format_date
+
+from odoo.addons.basic_hms.model.medical_action_profile import profiled
+from odoo.addons.basic_hms.model.medical_invoice_job import PG_CONCURRENCY_ERRORS
+
+CONSOLIDATION_PERIOD_PARAM = 'appointment_integration.consolidation_period'
+CONSOLIDATION_PERIODS = ('all', 'week', 'month')
 
 
 class MedicalPatient(models.Model):
     _inherit = 'medical.patient'
 
+    @profiled()
     def action_sync_appointments(self):
         """Sync calendar events to create medical appointments"""
         self.ensure_one()
@@ -22,227 +32,333 @@ class MedicalPatient(models.Model):
         
         if not calendar_events:
             raise UserError(_('No unprocessed calendar events found for this patient.'))
-        
-        # Group events by date
-        events_by_date = {}
-        for event in calendar_events:
-            event_date = event.start.date() if event.start else fields.Date.today()
-            if event_date not in events_by_date:
-                events_by_date[event_date] = []
-            events_by_date[event_date].append(event)
-        
-        created_appointments = []
-        
-        # Create medical appointments for each date
-        for appointment_date, events in events_by_date.items():
-            # Collect all therapy types from all events on this date
-            all_therapy_ids = []
-            appointment_comments = []
-            
-            for event in events:
-                # Mark event as processed
-                event.is_computed_as_medical_appointment = True
-                
-                # Add event name to comments
-                appointment_comments.append(f"Calendar Event: {event.name}")
-                
-                # Get therapy types based on appointment type or resource names
-                therapy_ids = self._get_therapy_ids_from_event(event)
-                if therapy_ids:
-                    all_therapy_ids.extend(therapy_ids)
-                    appointment_comments.append(f"Therapies: {', '.join(self.env['therapy.type'].browse(therapy_ids).mapped('name'))}")
-                else:
-                    appointment_comments.append("No specific therapy identified")
-            
-            # Remove duplicates from therapy IDs
-            all_therapy_ids = list(set(all_therapy_ids))
-            
-            # Create medical appointment
-            medical_appointment = self.env['medical.appointment'].create({
-                'patient_id': self.id,
-                'appointment_date': appointment_date,
-                'state': 'pending',
-                'therapy_ids': [(6, 0, all_therapy_ids)],
-                'comments': '\n'.join(appointment_comments),
-            })
-            
-            created_appointments.append(medical_appointment)
+
+        created_appointments = calendar_events._sync_medical_appointments()
         
         # Show success message
         if created_appointments:
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Sync Completed'),
-                    'message': _('Successfully created %d medical appointment(s) from %d calendar event(s).') % (
-                        len(created_appointments), len(calendar_events)
-                    ),
-                    'type': 'success',
-                    'sticky': False,
-                }
-            }
+            return self._sync_notification(created_appointments, calendar_events)
         
         return True
 
-    def _get_therapy_ids_from_event(self, event):
+    @api.model
+    @profiled()
+    def action_sync_all_appointments(self):
+        """Sync the unprocessed calendar events of every patient in one pass"""
+        today = fields.Date.today()
+        calendar_events = self.env['calendar.event'].search([
+            ('partner_ids.is_patient', '=', True),
+            ('is_computed_as_medical_appointment', '=', False),
+            ('start', '<=', today),
+        ])
+        if not calendar_events:
+            raise UserError(_('No unprocessed calendar events found.'))
+
+        created_appointments = calendar_events._sync_medical_appointments()
+        return self._sync_notification(created_appointments, calendar_events)
+
+    @api.model
+    def _sync_notification(self, appointments, events):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Sync Completed'),
+                'message': _('Successfully created %d medical appointment(s) from %d calendar event(s).') % (
+                    len(appointments), len(events)
+                ),
+                'type': 'success',
+                'sticky': False,
+            }
+        }
+
+    @api.model
+    def _get_resource_therapy_map(self):
+        """Return {appointment resource id: therapy type id}, first therapy wins"""
+        therapy_map = {}
+        for therapy in self.env['therapy.type'].search([('appointment_resource_id', '!=', False)], order='id'):
+            therapy_map.setdefault(therapy.appointment_resource_id.id, therapy.id)
+        return therapy_map
+
+    def _get_therapy_ids_from_event(self, event, therapy_map=None):
         """Extract therapy IDs from calendar event resources"""
+        if therapy_map is None:
+            therapy_map = self._get_resource_therapy_map()
         therapy_ids = []
         
         # Get therapy types from appointment resources
         if hasattr(event, 'appointment_resource_ids') and event.appointment_resource_ids:
             for resource in event.appointment_resource_ids:
                 # Find therapy type linked to this resource
-                therapy = self.env['therapy.type'].search([
-                    ('appointment_resource_id', '=', resource.id)
-                ], limit=1)
-                
-                if therapy and therapy.id not in therapy_ids:
-                    therapy_ids.append(therapy.id)
+                therapy_id = therapy_map.get(resource.id)
+                if therapy_id and therapy_id not in therapy_ids:
+                    therapy_ids.append(therapy_id)
         
         return therapy_ids
 
+    @profiled()
     def action_create_consolidated_invoice(self):
-        """Create a consolidated invoice for all unpaid appointments of this patient"""
+        """Create the consolidated invoice(s) of all unpaid appointments of this patient"""
         self.ensure_one()
-        
-        # Find all medical appointments for this patient without invoices
-        unpaid_appointments = self.env['medical.appointment'].search([
-            ('patient_id', '=', self.id),
-            ('invoice_id', '=', False),
-            ('state', '!=', 'cancelled')  # Exclude cancelled appointments
-        ])
-        
-        if not unpaid_appointments:
-            raise UserError(_('No unpaid appointments found for this patient.'))
-        
-        # Group therapies by product to consolidate quantities
-        therapy_consolidation = {}
-        
-        for appointment in unpaid_appointments:
-            for therapy in appointment.therapy_ids:
-                if not therapy.product_id:
-                    raise UserError(_('Therapy "%s" does not have an associated product. Please configure products for all therapies.') % therapy.name)
-                
-                product_id = therapy.product_id.id
-                if product_id not in therapy_consolidation:
-                    therapy_consolidation[product_id] = {
-                        'product': therapy.product_id,
-                        'quantity': 0,
-                        'therapy_type_id': therapy.id
-                    }
-                therapy_consolidation[product_id]['quantity'] += 1
-        
-        # Create the consolidated invoice
-        sale_journals = self.env['account.journal'].search([('type', '=', 'sale')])
-        if not sale_journals:
-            raise UserError(_('No sale journal found. Please configure a sale journal.'))
-        
-        # Get patient partner
-        if not self.patient_id:
-            raise UserError(_('No patient partner associated with this medical patient record.'))
-        
-        # Create invoice header
-        invoice_vals = {
-            'name': self.env['ir.sequence'].next_by_code('medical_consolidated_inv_seq'),
-            'invoice_origin': f'Consolidated Invoice - {self.name}',
-            'move_type': 'out_invoice',
-            'ref': False,
-            'partner_id': self.patient_id.id,
-            'partner_shipping_id': self.patient_id.id,
-            'currency_id': self.patient_id.currency_id.id,
-            'invoice_payment_term_id': False,
-            'fiscal_position_id': self.patient_id.property_account_position_id.id,
-            'team_id': False,
-            'invoice_date': fields.Date.today(),
-            'journal_id': sale_journals.id,
-            'state': 'draft',  # Keep as draft
-        }
-        
-        invoice = self.env['account.move'].create(invoice_vals)
-        
-        # Create invoice lines for consolidated therapies
-        for product_id, consolidation_data in therapy_consolidation.items():
-            product = consolidation_data['product']
-            quantity = consolidation_data['quantity']
-            therapy_type_id = consolidation_data['therapy_type_id']
-            
-            # Get account
-            invoice_line_account_id = (product.property_account_income_id.id or
-                                      product.categ_id.property_account_income_categ_id.id or
-                                      False)
-            
-            if not invoice_line_account_id:
-                raise UserError(
-                    _('There is no income account defined for product: "%s". You may have to install a chart of account from Accounting app, settings menu.') %
-                    (product.name,))
-            
-            # Get taxes
-            tax_ids = []
-            taxes = product.taxes_id.filtered(
-                lambda r: not product.company_id or r.company_id == product.company_id)
-            tax_ids = taxes.ids
-            
-            # Create invoice line
-            invoice_line_vals = {
-                'name': f"{product.name} (Consolidated - {quantity} sessions)",
-                'account_id': invoice_line_account_id,
-                'price_unit': product.list_price,
-                'quantity': quantity,
-                'product_uom_id': product.uom_id.id,
-                'product_id': product.id,
-                'tax_ids': [(6, 0, tax_ids)],
-                'therapy_type_id': therapy_type_id,
-            }
-            
-            invoice.write({'invoice_line_ids': [(0, 0, invoice_line_vals)]})
-        
-        # Update all related appointments with the new invoice
-        unpaid_appointments.write({
-            'invoice_id': invoice.id,
-            'is_invoiced': True
-        })
-        
-        # Create a clean log message with proper formatting
-        therapy_lines_text = ""
-        for product_id, consolidation_data in therapy_consolidation.items():
-            product = consolidation_data['product']
-            quantity = consolidation_data['quantity']
-            total_line_amount = product.list_price * quantity
-            therapy_lines_text += f"• {product.name}: {quantity} session(s) × {invoice.currency_id.symbol}{product.list_price:.2f} = {invoice.currency_id.symbol}{total_line_amount:.2f}\n"
-        
-        log_message = f"""
-Consolidated Invoice Created
-
-Successfully created consolidated invoice for {len(unpaid_appointments)} appointment(s) with {len(therapy_consolidation)} therapy line(s).
-
-Invoice Details:
-• Invoice Number: {invoice.name}
-• Total Amount: {invoice.currency_id.symbol}{invoice.amount_total:.2f}
-• Status: Draft
+        invoices = self._create_consolidated_invoice()
+        appointment_count = self.env['medical.appointment'].search_count([('invoice_id', 'in', invoices.ids)])
 
-Consolidated Therapy Lines:
-{therapy_lines_text}
-Invoice Reference: {invoice.name} (ID: {invoice.id})
-        """
-        
-        # Add the log note to the patient record
-        self.message_post(
-            body=log_message,
-            subject=_('Consolidated Invoice Created'),
-            message_type='notification'
-        )
-        
         # Show success message
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
                 'title': _('Consolidated Invoice Created'),
-                'message': _('Successfully created consolidated invoice for %d appointment(s) with %d therapy line(s). Check the chatter for details.') % (
-                    len(unpaid_appointments), len(therapy_consolidation)
+                'message': _('Successfully created %d consolidated invoice(s) for %d appointment(s) with %d therapy line(s). Check the chatter for details.') % (
+                    len(invoices), appointment_count, len(invoices.invoice_line_ids)
                 ),
                 'type': 'success',
                 'sticky': False,
             }
         }
+
+    @profiled()
+    def action_create_consolidated_invoices(self):
+        """Create the consolidated invoices of the selected patients at once"""
+        invoices, errors = self._create_consolidated_invoices()
+        message = _('%d consolidated invoice(s) created for %d patient(s).') % (
+            len(invoices), len(self) - len(errors))
+        if errors:
+            message += '\n' + _('Skipped: %s') % '; '.join(
+                '%s: %s' % (patient.display_name, errors[patient.id]) for patient in self.browse(errors))
+        params = {
+            'title': _('Consolidated Invoices'),
+            'message': message,
+            'type': 'warning' if errors else 'success',
+            'sticky': bool(errors),
+        }
+        if invoices:
+            params['next'] = {
+                'type': 'ir.actions.act_window',
+                'name': _('Consolidated Invoices'),
+                'res_model': 'account.move',
+                'view_mode': 'list,form',
+                'views': [(False, 'list'), (False, 'form')],
+                'domain': [('id', 'in', invoices.ids)],
+                'context': {'create': False},
+            }
+        return {'type': 'ir.actions.client', 'tag': 'display_notification', 'params': params}
+
+    @profiled()
+    def action_create_consolidated_invoice_job(self):
+        """Queue consolidated invoicing of the selected patients as a background job"""
+        job = self.env['medical.invoice.job']._create_job('consolidated_invoice', self)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Invoicing Job'),
+            'res_model': 'medical.invoice.job',
+            'res_id': job.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    @api.model
+    def _get_consolidation_period(self):
+        """Return the configured consolidation period: 'all' for a single
+        invoice, or a date_trunc granularity ('week', 'month')."""
+        period = self.env['ir.config_parameter'].sudo().get_param(CONSOLIDATION_PERIOD_PARAM, 'all')
+        return period if period in CONSOLIDATION_PERIODS else 'all'
+
+    @api.model
+    def _get_consolidated_sessions(self, appointments, period):
+        """Count the therapy sessions of appointments with one grouped query
+        over the therapy relation.
+
+        Returns [(patient id, period start or None, product id, therapy type
+        id, sessions)] ordered by patient and period.
+        """
+        Appointment = self.env['medical.appointment']
+        Appointment.flush_model(['patient_id', 'attendance_date', 'therapy_ids'])
+        self.env['therapy.type'].flush_model(['product_id'])
+        relation = Appointment._fields['therapy_ids']
+        period_sql = SQL("date_trunc(%s, apt.attendance_date)::date", period) if period != 'all' else SQL("NULL::date")
+        self.env.cr.execute(SQL("""
+            SELECT apt.patient_id, %(period)s AS period, therapy.product_id, therapy.id, COUNT(*)
+              FROM medical_appointment apt
+              JOIN %(relation)s rel ON rel.%(apt_column)s = apt.id
+              JOIN therapy_type therapy ON therapy.id = rel.%(therapy_column)s
+             WHERE apt.id = ANY(%(ids)s)
+          GROUP BY apt.patient_id, 2, therapy.product_id, therapy.id
+          ORDER BY apt.patient_id, 2, therapy.product_id, therapy.id
+        """, period=period_sql, relation=SQL.identifier(relation.relation),
+             apt_column=SQL.identifier(relation.column1), therapy_column=SQL.identifier(relation.column2),
+             ids=appointments.ids))
+        return self.env.cr.fetchall()
+
+    def _create_consolidated_invoice(self, period=None):
+        """Create the consolidated invoices of this patient, see
+        _create_consolidated_invoices. Errors are raised."""
+        self.ensure_one()
+        invoices, errors = self._create_consolidated_invoices(period)
+        if errors:
+            raise UserError(errors[self.id])
+        return invoices
+
+    def _create_consolidated_invoices(self, period=None):
+        """Create the consolidated invoices of the patients of self: a single
+        one per patient, or one per patient and period (see
+        _get_consolidation_period) with appointments.
+
+        Journal, products and accounts are resolved once for all patients,
+        every invoice is created by one account.move create and each patient
+        gets one summary note. Patients that cannot be invoiced, including
+        those whose invoices fail to be created, are skipped and reported
+        rather than aborting the batch (see _create_consolidated_moves).
+
+        Returns (invoices, errors) where errors maps each skipped patient id
+        to its message.
+        """
+        period = period or self._get_consolidation_period()
+        Appointment = self.env['medical.appointment']
+        errors = {}
+
+        sale_journal = self.env['account.journal'].search([('type', '=', 'sale')], limit=1)
+        if not sale_journal:
+            raise UserError(_('No sale journal found. Please configure a sale journal.'))
+
+        # Find all medical appointments of the patients without invoices
+        unpaid_appointments = Appointment.search_fetch([
+            ('patient_id', 'in', self.ids),
+            ('invoice_id', '=', False),
+        ], ['patient_id', 'attendance_date'])
+        patients_with_visits = unpaid_appointments.patient_id
+        for patient in self - patients_with_visits:
+            errors[patient.id] = _('No unpaid appointments found for this patient.')
+        for patient in patients_with_visits.filtered(lambda patient: not patient.patient_id):
+            errors[patient.id] = _('No patient partner associated with this medical patient record.')
+
+        # Sessions per patient, period and product, counted in SQL
+        sessions = self._get_consolidated_sessions(unpaid_appointments, period)
+        therapies = self.env['therapy.type'].browse({row[3] for row in sessions})
+        # Warm the cache for the whole batch before building the vals
+        patients_with_visits.mapped('patient_id.property_account_position_id')
+
+        lines_by_key = {}
+        for patient_id, period_start, _product_id, therapy_id, quantity in sessions:
+            if patient_id in errors:
+                continue
+            therapy = therapies.browse(therapy_id)
+            product = therapy.product_id
+            try:
+                if not product:
+                    raise UserError(_('Therapy "%s" does not have an associated product. Please configure products for all therapies.') % therapy.name)
+                line_template = product._get_medical_invoice_line_template()
+            except UserError as e:
+                errors[patient_id] = e.args[0]
+                continue
+            lines_by_key.setdefault((patient_id, period_start), []).append(Command.create(dict(
+                line_template,
+                name=f"{product.name} (Consolidated - {quantity} sessions)",
+                quantity=quantity,
+                therapy_type_id=therapy_id,
+            )))
+
+        patient_ids_with_lines = {patient_id for patient_id, _period_start in lines_by_key}
+        for patient in patients_with_visits:
+            if patient.id not in errors and patient.id not in patient_ids_with_lines:
+                errors[patient.id] = _('No therapies selected on the unpaid appointments of this patient.')
+        keys = [key for key in lines_by_key if key[0] not in errors]
+        names = self.env['ir.sequence']._next_by_code_batch('medical_consolidated_inv_seq', len(keys))
+        vals_list = []
+        for (patient_id, period_start), name in zip(keys, names):
+            patient = self.browse(patient_id)
+            partner = patient.patient_id
+            origin = f'Consolidated Invoice - {patient.name}'
+            if period_start:
+                origin = f'{origin} - {self._format_consolidation_period(period_start, period)}'
+            vals_list.append({
+                'name': name,
+                'invoice_origin': origin,
+                'move_type': 'out_invoice',
+                'ref': False,
+                'partner_id': partner.id,
+                'partner_shipping_id': partner.id,
+                'currency_id': partner.currency_id.id,
+                'invoice_payment_term_id': False,
+                'fiscal_position_id': partner.property_account_position_id.id,
+                'team_id': False,
+                'invoice_date': fields.Date.today(),
+                'journal_id': sale_journal.id,
+                'invoice_line_ids': lines_by_key[(patient_id, period_start)],
+            })
+        invoice_by_key = self._create_consolidated_moves(keys, vals_list, errors)
+        invoices = self.env['account.move'].union(*invoice_by_key.values())
+
+        # Link each appointment to the invoice of its patient and period;
+        # appointments without therapies go with the invoice of their period
+        appointment_ids_by_invoice = {}
+        for appointment in unpaid_appointments:
+            period_start = date_utils.start_of(appointment.attendance_date, period) \
+                if period != 'all' and appointment.attendance_date else None
+            invoice = invoice_by_key.get((appointment.patient_id.id, period_start))
+            if invoice:
+                appointment_ids_by_invoice.setdefault(invoice, []).append(appointment.id)
+        appointment_count = {}
+        for invoice, appointment_ids in appointment_ids_by_invoice.items():
+            Appointment.browse(appointment_ids).write({
+                'invoice_id': invoice.id,
+                'is_invoiced': True
+            })
+            appointment_count[invoice] = len(appointment_ids)
+
+        # One summary note per invoiced patient
+        invoices_by_patient = {}
+        for (patient_id, _period_start), invoice in invoice_by_key.items():
+            invoices_by_patient.setdefault(patient_id, self.env['account.move'])
+            invoices_by_patient[patient_id] |= invoice
+        bodies = {}
+        for patient_id, patient_invoices in invoices_by_patient.items():
+            items = Markup().join(
+                Markup('<li>%s</li>') % _('%(name)s (%(origin)s): %(count)s appointment(s), %(lines)s therapy line(s), %(amount)s',
+                    name=invoice.name, origin=invoice.invoice_origin, count=appointment_count.get(invoice, 0),
+                    lines=len(invoice.invoice_line_ids),
+                    amount=format_amount(self.env, invoice.amount_total, invoice.currency_id))
+                for invoice in patient_invoices)
+            bodies[patient_id] = Markup('<p>%s</p><ul>%s</ul>') % (
+                _('%s draft consolidated invoice(s) created:', len(patient_invoices)), items)
+        self.browse(bodies)._message_log_batch(bodies, subject=_('Consolidated Invoice Created'))
+
+        return invoices, errors
+
+    def _create_consolidated_moves(self, keys, vals_list, errors):
+        """Create the invoices of vals_list, one per (patient id, period) of
+        keys, and return them by key.
+
+        All invoices are created by a single create. If it fails, each
+        patient's invoices are created in their own savepoint, so only the
+        patients whose invoices fail (lock date, company checks, constraints,
+        ...) are reported in errors and skipped.
+        """
+        Move = self.env['account.move']
+        try:
+            with self.env.cr.savepoint():
+                return dict(zip(keys, Move.create(vals_list)))
+        except PG_CONCURRENCY_ERRORS:
+            raise
+        except Exception:
+            pass
+        indexes_by_patient = {}
+        for index, (patient_id, _period_start) in enumerate(keys):
+            indexes_by_patient.setdefault(patient_id, []).append(index)
+        invoice_by_key = {}
+        for patient_id, indexes in indexes_by_patient.items():
+            try:
+                with self.env.cr.savepoint():
+                    patient_invoices = Move.create([vals_list[index] for index in indexes])
+            except PG_CONCURRENCY_ERRORS:
+                raise
+            except Exception as e:
+                errors[patient_id] = e.args[0] if isinstance(e, UserError) and e.args else str(e)
+                continue
+            invoice_by_key.update(zip([keys[index] for index in indexes], patient_invoices))
+        return invoice_by_key
+
+    def _format_consolidation_period(self, period_start, period):
+        if period == 'month':
+            return format_date(self.env, period_start, date_format='MMMM y')
+        return _('Week of %s') % format_date(self.env, period_start)
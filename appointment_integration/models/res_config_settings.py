@@ -0,0 +1,14 @@
+from odoo import models, fields
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    medical_consolidation_period = fields.Selection([
+        ('all', 'Single invoice'),
+        ('week', 'One invoice per week'),
+        ('month', 'One invoice per month'),
+    ], string='Consolidated Invoicing', default='all',
+        config_parameter='appointment_integration.consolidation_period',
+        help='How the unpaid appointments of a patient are split into consolidated invoices, '
+             'by attendance date.')
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 # Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+from . import controllers
 from . import wizard
 from . import model
 
@@ -43,12 +43,19 @@
         'data/product_data.xml',
         'data/doctor_recrods.xml',
         'data/therapy_type_data.xml',
+        'data/ir_cron_data.xml',
         'views/login_page.xml',
         'views/main_menu_file.xml',
         'wizard/medical_appointments_invoice_wizard.xml',
         'wizard/medical_appointments_therapy_invoice_wizard.xml',
+        'wizard/medical_commission_recompute_wizard.xml',
         'views/medical_appointment.xml',
         'views/therapy_type.xml',
+        'views/medical_commission.xml',
+        'views/medical_revenue_cube.xml',
+        'views/medical_invoice_job.xml',
+        'views/medical_action_profile.xml',
+        'views/res_config_settings.xml',
         'views/medical_patient_medication.xml',
         'views/medical_patient.xml',
         'views/medical_physician.xml',
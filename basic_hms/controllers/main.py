@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import http
+from odoo.http import request
+
+
+class MedicalRevenueController(http.Controller):
+
+    @http.route('/basic_hms/revenue', type='json', auth='user')
+    def revenue(self, groupby=('month',), date_from=None, date_to=None,
+                therapy_type_ids=None, doctor_ids=None, patient_ids=None):
+        """Therapy revenue, sessions and commission from the revenue cube,
+        e.g. {"groupby": ["year", "therapy_type"], "date_from": "2023-01-01"}."""
+        return request.env['medical.revenue.cube'].get_dashboard_data(
+            groupby=groupby, date_from=date_from, date_to=date_to,
+            therapy_type_ids=therapy_type_ids, doctor_ids=doctor_ids, patient_ids=patient_ids)
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -13,9 +13,17 @@ from . import medical_physician
 from . import medical_signs_and_sympotoms
 from . import medical_vaccitation
 from . import pet_type
+from . import product_template
 from . import psc_code
 from . import res_partner
 from . import therapy_type
+from . import account_move
 from . import account_move_line
+from . import medical_commission
+from . import medical_revenue_cube
+from . import medical_invoice_job
+from . import medical_action_profile
+from . import res_config_settings
+from . import ir_sequence
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
\ No newline at end of file
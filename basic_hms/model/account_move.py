@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import models
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    def _get_therapy_invoices(self):
+        """Return the customer invoices and refunds of self with therapy lines:
+        the only moves the commission ledger and the revenue cube track."""
+        return self.filtered(lambda move: move.move_type in ('out_invoice', 'out_refund')
+                             and any(line.therapy_type_id for line in move.invoice_line_ids))
+
+    def _post(self, soft=True):
+        posted = super()._post(soft)
+        therapy_invoices = posted._get_therapy_invoices()
+        if therapy_invoices:
+            self.env['medical.commission.line']._generate_for_moves(therapy_invoices)
+            self.env['medical.revenue.cube']._refresh_for_moves(therapy_invoices)
+        return posted
+
+    def button_draft(self):
+        # Also reached when a posted move is cancelled. Only posted therapy
+        # invoices have ledger entries and cube cells to take back.
+        therapy_invoices = self.filtered(lambda move: move.state == 'posted')._get_therapy_invoices()
+        if therapy_invoices:
+            self.env['medical.commission.line'].sudo().search([('move_id', 'in', therapy_invoices.ids)]).unlink()
+        res = super().button_draft()
+        self.env['medical.revenue.cube']._refresh_for_moves(therapy_invoices)
+        return res
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
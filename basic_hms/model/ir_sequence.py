@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def _next_by_code_batch(self, sequence_code, count, sequence_date=None):
+        """Batched next_by_code: return count successive values of the
+        sequence sequence_code, reserved with a single query ("standard"
+        implementation) or a single locked update ("no_gap").
+
+        Like next_by_code, returns False values when no sequence matches.
+        """
+        if count <= 0:
+            return []
+        self.browse().check_access('read')
+        company_id = self.env.company.id
+        sequences = self.search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
+                                order='company_id')
+        if not sequences:
+            _logger.debug("No ir.sequence has been found for code '%s'. Please make sure a sequence is "
+                          "set for current company.", sequence_code)
+            return [False] * count
+        return sequences[0]._next_batch(count, sequence_date=sequence_date)
+
+    def _next_batch(self, count, sequence_date=None):
+        """Return the next count values of the sequence, see _next_by_code_batch."""
+        self.ensure_one()
+        if not self.use_date_range:
+            numbers = self._reserve_numbers(self.sudo(), 'ir_sequence_%03d' % self.id, count)
+            return [self.get_next_char(number) for number in numbers]
+        dt = sequence_date or self._context.get('ir_sequence_date', fields.Date.today())
+        seq_date = self.env['ir.sequence.date_range'].sudo().search([
+            ('sequence_id', '=', self.id), ('date_from', '<=', dt), ('date_to', '>=', dt)], limit=1)
+        if not seq_date:
+            seq_date = self.sudo()._create_date_range_seq(dt)
+        numbers = self._reserve_numbers(seq_date, 'ir_sequence_%03d_%03d' % (self.id, seq_date.id), count)
+        sequence = self.with_context(ir_sequence_date=dt, ir_sequence_date_range=seq_date.date_from)
+        return [sequence.get_next_char(number) for number in numbers]
+
+    def _reserve_numbers(self, record, sequence_name, count):
+        """Reserve count numbers on record (an ir.sequence or one of its date
+        ranges) and return them in order."""
+        if self.implementation == 'standard':
+            # The PostgreSQL sequence already applies number_increment
+            self.env.cr.execute(SQL("SELECT nextval(%s) FROM generate_series(1, %s) ORDER BY 1",
+                                    sequence_name, count))
+            return [row[0] for row in self.env.cr.fetchall()]
+        # no_gap: lock the row the same way ir.sequence does, then move
+        # number_next past the whole batch at once
+        step = self.number_increment
+        self.env.cr.execute(SQL("SELECT number_next FROM %s WHERE id = %s FOR UPDATE NOWAIT",
+                                SQL.identifier(record._table), record.id))
+        self.env.cr.execute(SQL("UPDATE %s SET number_next = number_next + %s WHERE id = %s RETURNING number_next",
+                                SQL.identifier(record._table), step * count, record.id))
+        number_next = self.env.cr.fetchone()[0] - step * count
+        record.invalidate_recordset(['number_next'])
+        return [number_next + step * index for index in range(count)]
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from odoo import api, fields, models, tools
+from odoo.tools import str2bool
+
+PROFILING_PARAM = 'basic_hms.profiling'
+
+
+def _is_profiling_enabled(env):
+    # get_param is cached: checking the toggle does not cost a query
+    return 'medical.action.profile' in env.registry and \
+        str2bool(env['ir.config_parameter'].sudo().get_param(PROFILING_PARAM, 'False'))
+
+
+@contextmanager
+def profile_action(env, action, record_count=0):
+    """Log the query count, SQL time and Python time of the wrapped block in
+    medical.action.profile, when profiling is enabled in the settings.
+
+    Calls that raise are not logged: their transaction is rolled back.
+    """
+    if not _is_profiling_enabled(env):
+        yield
+        return
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        # Only HTTP requests initialize the counters the cursor updates
+        thread.query_count = 0
+        thread.query_time = 0
+    query_count, query_time = thread.query_count, thread.query_time
+    start = time.perf_counter()
+    yield
+    total_time = (time.perf_counter() - start) * 1000
+    sql_time = (thread.query_time - query_time) * 1000
+    env['medical.action.profile'].sudo().create({
+        'action': action,
+        'user_id': env.uid,
+        'record_count': record_count,
+        'query_count': thread.query_count - query_count,
+        'sql_time': sql_time,
+        'python_time': max(total_time - sql_time, 0.0),
+        'total_time': total_time,
+    })
+
+
+def profiled(action=None):
+    """Decorator profiling a model method with profile_action.
+
+    The action is logged as "<model>.<method>" unless action is given. For
+    wizards the record count is the number of active records.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._transient:
+                record_count = len(self.env.context.get('active_ids') or self)
+            else:
+                record_count = len(self)
+            name = action or '%s.%s' % (self._name, method.__name__)
+            with profile_action(self.env, name, record_count):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MedicalActionProfile(models.Model):
+    _name = 'medical.action.profile'
+    _description = 'Medical Action Profile'
+    _order = 'id desc'
+    _rec_name = 'action'
+
+    action = fields.Char(string='Action', required=True, index=True, readonly=True)
+    date = fields.Datetime(string='Date', default=fields.Datetime.now, required=True, index=True, readonly=True)
+    user_id = fields.Many2one('res.users', string='User', readonly=True)
+    record_count = fields.Integer(string='Records', readonly=True)
+    query_count = fields.Integer(string='Queries', readonly=True, aggregator='avg')
+    sql_time = fields.Float(string='SQL Time (ms)', readonly=True, digits=(16, 1), aggregator='avg')
+    python_time = fields.Float(string='Python Time (ms)', readonly=True, digits=(16, 1), aggregator='avg')
+    total_time = fields.Float(string='Total Time (ms)', readonly=True, digits=(16, 1), aggregator='avg')
+
+    @api.autovacuum
+    def _gc_action_profiles(self):
+        """Keep the profiles of the last 30 days."""
+        self.search([('date', '<', fields.Datetime.subtract(fields.Datetime.now(), days=30))]).unlink()
+
+
+class MedicalActionProfileStats(models.Model):
+    _name = 'medical.action.profile.stats'
+    _description = 'Medical Action Latency'
+    _auto = False
+    _order = 'p95_time desc'
+    _rec_name = 'action'
+
+    action = fields.Char(string='Action', readonly=True)
+    call_count = fields.Integer(string='Calls', readonly=True)
+    p50_time = fields.Float(string='p50 (ms)', readonly=True, digits=(16, 1), aggregator='max')
+    p95_time = fields.Float(string='p95 (ms)', readonly=True, digits=(16, 1), aggregator='max')
+    max_time = fields.Float(string='Max (ms)', readonly=True, digits=(16, 1), aggregator='max')
+    avg_query_count = fields.Float(string='Avg Queries', readonly=True, digits=(16, 1), aggregator='max')
+    p95_query_count = fields.Float(string='p95 Queries', readonly=True, digits=(16, 1), aggregator='max')
+    avg_sql_time = fields.Float(string='Avg SQL (ms)', readonly=True, digits=(16, 1), aggregator='max')
+    avg_python_time = fields.Float(string='Avg Python (ms)', readonly=True, digits=(16, 1), aggregator='max')
+    avg_record_count = fields.Float(string='Avg Records', readonly=True, digits=(16, 1), aggregator='max')
+    last_call = fields.Datetime(string='Last Call', readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE OR REPLACE VIEW %s AS (
+                SELECT MIN(id) AS id,
+                       action,
+                       COUNT(*) AS call_count,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY total_time) AS p50_time,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY total_time) AS p95_time,
+                       MAX(total_time) AS max_time,
+                       AVG(query_count) AS avg_query_count,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY query_count) AS p95_query_count,
+                       AVG(sql_time) AS avg_sql_time,
+                       AVG(python_time) AS avg_python_time,
+                       AVG(record_count) AS avg_record_count,
+                       MAX(date) AS last_call
+                  FROM medical_action_profile
+              GROUP BY action
+            )
+        """ % self._table)
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
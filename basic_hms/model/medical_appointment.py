@@ -1,7 +1,11 @@
-from odoo import api, fields, models, _
+from odoo import api, fields, models, Command, _
 from datetime import datetime, date
-from datetime import datetime, timedelta
 from odoo.exceptions import UserError
+from odoo.tools import unique
+from odoo.tools.sql import create_index
+from markupsafe import Markup
+
+from .medical_action_profile import profiled
 
 
 class medical_appointment(models.Model):
@@ -30,7 +34,7 @@ class medical_appointment(models.Model):
             ('c', 'Medical Emergency')], 'Urgency Level', sort=False,
             default='a')
     appointment_date = fields.Datetime('Appointment Date',
-            required=True, default=fields.Datetime.now, tracking=True)
+            required=True, default=fields.Datetime.now, tracking=True, index=True)
     appointment_end = fields.Datetime('Patient Exit time', tracking=True)
     doctor_id = fields.Many2one('medical.physician', 'Doctor',
                                 default=lambda self: self._default_doctor_id())
@@ -52,14 +56,24 @@ class medical_appointment(models.Model):
     # Removed insurer_id - model deleted
     therapy_ids = fields.Many2many('therapy.type', string='Therapies', tracking=True)
     duration = fields.Integer('Duration (Mins)')
-    invoice_id = fields.Many2one("account.move", string="Invoice", readonly=True)
+    invoice_id = fields.Many2one("account.move", string="Invoice", readonly=True, index='btree_not_null')
     state = fields.Selection([('pending','Pending'),('done','Completed')],string="State",default="pending", tracking=True)
     
     # Calendar and display fields
     therapy_names = fields.Char(string='Therapies', compute='_compute_therapy_names', store=True)
     calendar_color = fields.Char(string='Calendar Color', compute='_compute_calendar_color', store=True)
-    attendance_date = fields.Date(string='Attendance Date', compute='_compute_attendance_date', store=True)
+    attendance_date = fields.Date(string='Attendance Date', compute='_compute_attendance_date', store=True, index=True)
     
+    def init(self):
+        super().init()
+        # Visits of a patient in date order: previous/next visit windows,
+        # per-patient counts and appointment lists
+        create_index(self.env.cr, 'medical_appointment_patient_date_index', self._table,
+                     ['patient_id', 'appointment_date', 'id'])
+        # Appointments still to bill, looked up per patient by consolidated invoicing
+        create_index(self.env.cr, 'medical_appointment_uninvoiced_patient_index', self._table,
+                     ['patient_id', 'appointment_date'], where='invoice_id IS NULL')
+
     @api.depends('therapy_ids')
     def _compute_therapy_names(self):
         """Compute therapy names for calendar display"""
@@ -98,6 +112,7 @@ class medical_appointment(models.Model):
             else:
                 record.attendance_date = False
 
+    @profiled()
     def action_end_appointment(self):
         """Set appointment_end to current datetime and calculate duration."""
         for record in self:
@@ -123,9 +138,16 @@ class medical_appointment(models.Model):
             'context': "{'create': False}"
         }
 
+    @api.depends('patient_id', 'patient_id.appointment_count')
     def _compute_appointment_count(self):
+        """Derive the count from the patient's stored counter, so a whole
+        list or kanban of visits costs a single prefetch of the patients."""
         for record in self:
-            record.previous_appointment_count = self.search_count([('patient_id', '=', self.patient_id.id), ('id', '!=', record.id)])
+            count = record.patient_id.appointment_count
+            # the stored counter includes the visit itself once it is saved
+            if record._origin and record._origin.patient_id == record.patient_id:
+                count -= 1
+            record.previous_appointment_count = max(count, 0)
 
     @api.onchange('case_type')
     def _onchange_case_type(self):
@@ -139,28 +161,90 @@ class medical_appointment(models.Model):
 
     @api.depends('patient_id', 'appointment_date')
     def _compute_previous_appointment_days(self):
+        """Compute the chronologically preceding visit of each appointment.
+
+        Stored records are resolved in one windowed query over the patients
+        of the batch; records still living in an onchange cache fall back to
+        a regular search.
+        """
+        stored = self.filtered(lambda r: isinstance(r.id, int))
+        previous_dates = stored._get_previous_appointment_dates()
         for record in self:
-            if record.patient_id:
-                previous_appointment = self.env['medical.appointment'].search([
+            if not record.patient_id or not record.appointment_date:
+                record.previous_appointment_date = False
+                record.previous_appointment_days = "N/A"
+                continue
+            if record in stored:
+                previous_date = previous_dates.get(record.id)
+            else:
+                previous_date = self.search([
                     ('patient_id', '=', record.patient_id.id),
-                    ('id', '!=', record.id)
-                ], order='appointment_date DESC', limit=1)
-
-                if previous_appointment:
-                    record.previous_appointment_date = previous_appointment.appointment_date
-
-                    # Calculate the days difference
-                    if record.appointment_date and previous_appointment.appointment_date:
-                        delta_days = (record.appointment_date.date() - previous_appointment.appointment_date.date()).days
-                        record.previous_appointment_days = f"{delta_days} days" if delta_days >= 0 else "0 days"
-                    else:
-                        record.previous_appointment_days = "N/A"
-                else:
-                    record.previous_appointment_date = False
-                    record.previous_appointment_days = "N/A"
+                    ('id', '!=', record._origin.id),
+                    ('appointment_date', '<=', record.appointment_date),
+                ], order='appointment_date DESC, id DESC', limit=1).appointment_date
+            if previous_date:
+                record.previous_appointment_date = previous_date
+                delta_days = (record.appointment_date.date() - previous_date.date()).days
+                record.previous_appointment_days = f"{delta_days} days" if delta_days >= 0 else "0 days"
             else:
+                record.previous_appointment_date = False
                 record.previous_appointment_days = "N/A"
 
+    def _get_previous_appointment_dates(self):
+        """Return {appointment_id: previous appointment_date} for self.
+
+        A single LAG() pass over every visit of the patients involved, ordered
+        by appointment_date, gives the true preceding visit of each record.
+        """
+        if not self:
+            return {}
+        self.flush_model(['patient_id', 'appointment_date'])
+        self.env.cr.execute("""
+            SELECT id, previous_date
+              FROM (
+                    SELECT id,
+                           LAG(appointment_date) OVER (
+                               PARTITION BY patient_id
+                               ORDER BY appointment_date, id
+                           ) AS previous_date
+                      FROM medical_appointment
+                     WHERE patient_id IN (
+                            SELECT patient_id FROM medical_appointment WHERE id = ANY(%s)
+                     )
+                   ) AS visits
+             WHERE id = ANY(%s)
+        """, [self.ids, self.ids])
+        return dict(self.env.cr.fetchall())
+
+    def _get_next_appointments(self):
+        """Return the visits that directly follow the records of self."""
+        if not self:
+            return self.browse()
+        self.flush_model(['patient_id', 'appointment_date'])
+        self.env.cr.execute("""
+            SELECT next_id
+              FROM (
+                    SELECT id,
+                           LEAD(id) OVER (
+                               PARTITION BY patient_id
+                               ORDER BY appointment_date, id
+                           ) AS next_id
+                      FROM medical_appointment
+                     WHERE patient_id IN (
+                            SELECT patient_id FROM medical_appointment WHERE id = ANY(%s)
+                     )
+                   ) AS visits
+             WHERE id = ANY(%s) AND next_id IS NOT NULL
+        """, [self.ids, self.ids])
+        return self.browse(row[0] for row in self.env.cr.fetchall())
+
+    def _recompute_previous_appointment(self):
+        """Schedule the previous-visit fields of self for recomputation."""
+        records = self.exists()
+        if records:
+            for fname in ('previous_appointment_date', 'previous_appointment_days'):
+                self.env.add_to_compute(self._fields[fname], records)
+
     @api.model
     def _default_doctor_id(self):
         return self.env.ref('basic_hms.medical_physician_1', raise_if_not_found=False) or self.env['medical.physician'].search([], limit=1)
@@ -174,13 +258,52 @@ class medical_appointment(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         today_str = datetime.today().strftime("%d%m%y")
-        for vals in vals_list:
-            apt_id = self.env['ir.sequence' ].next_by_code('medical.appointment' ) or 'VISIT'
-            vals['name'] = f"VISIT{today_str}-{apt_id}"
-            msg_body = 'Visit created'
-            for msg in self:
-                msg.message_post(body=msg_body)
-        return super(medical_appointment, self).create(vals_list)
+        apt_ids = self.env['ir.sequence']._next_by_code_batch('medical.appointment', len(vals_list))
+        for vals, apt_id in zip(vals_list, apt_ids):
+            vals['name'] = f"VISIT{today_str}-{apt_id or 'VISIT'}"
+        # Bulk ingestion (imports, syncs): no creation log, followers or
+        # tracking per visit, a single summary note per patient instead
+        source = self.env.context.get('medical_bulk_ingest')
+        model = self
+        if source:
+            model = self.with_context(tracking_disable=True, mail_create_nolog=True,
+                                      mail_create_nosubscribe=True)
+        # The caller gets the records back in its own environment
+        records = super(medical_appointment, model).create(vals_list).with_env(self.env)
+        if source:
+            records._log_bulk_ingest(source)
+        # A new visit becomes the previous visit of the one that follows it
+        (records._get_next_appointments() - records)._recompute_previous_appointment()
+        return records
+
+    def _log_bulk_ingest(self, source):
+        """Log on each patient one note listing the visits of self created by source."""
+        visits_by_patient = {}
+        for record in self:
+            visits_by_patient.setdefault(record.patient_id, []).append(record.name)
+        bodies = {}
+        for patient, names in visits_by_patient.items():
+            bodies[patient.id] = Markup('<p>%s</p>') % _('%(count)s visit(s) created by %(source)s: %(names)s',
+                count=len(names), source=source if isinstance(source, str) else _('a bulk import'),
+                names=', '.join(names))
+        self.env['medical.patient'].browse(bodies)._message_log_batch(bodies)
+
+    def write(self, vals):
+        moved = 'patient_id' in vals or 'appointment_date' in vals
+        followers = self._get_next_appointments() if moved else self.browse()
+        res = super(medical_appointment, self).write(vals)
+        if moved:
+            # Both the old and the new successors see a different previous visit
+            followers |= self._get_next_appointments()
+            (followers - self)._recompute_previous_appointment()
+        return res
+
+    def unlink(self):
+        followers = self._get_next_appointments() - self
+        res = super(medical_appointment, self).unlink()
+        followers._recompute_previous_appointment()
+        return res
+
 
     # Removed onchange_patient - field deleted
 
@@ -200,6 +323,85 @@ class medical_appointment(models.Model):
     def view_patient_invoice(self):
         self.write({'state': 'cancel'})
 
+    def _prepare_therapy_invoice_vals(self, journal):
+        """Build the vals of the therapy invoice of this appointment, lines
+        included but not the invoice number, which the caller reserves for
+        the whole batch. Any inconsistency is raised as a UserError."""
+        self.ensure_one()
+        if self.is_invoiced:
+            raise UserError(_('Appointment %s is already invoiced.') % self.name)
+        if self.no_invoice:
+            raise UserError(_('Appointment %s is invoice exempt.') % self.name)
+        if not self.therapy_ids:
+            raise UserError(_('No therapies selected for appointment %s.') % self.name)
+
+        line_commands = []
+        for therapy in self.therapy_ids:
+            product = therapy.product_id
+            if not product:
+                raise UserError(_('No product associated with therapy %s.') % therapy.name)
+            line_commands.append(Command.create(dict(
+                product._get_medical_invoice_line_template(),
+                quantity=1,
+                therapy_type_id=therapy.id,  # Link to therapy type for commission calculation
+            )))
+
+        partner = self.patient_id.patient_id
+        return {
+            'invoice_origin': self.name or '',
+            'move_type': 'out_invoice',
+            'partner_id': partner.id or False,
+            'partner_shipping_id': partner.id,
+            'currency_id': partner.currency_id.id,
+            'invoice_payment_term_id': False,
+            'fiscal_position_id': partner.property_account_position_id.id,
+            'team_id': False,
+            'invoice_date': date.today(),
+            'journal_id': journal.id,
+            'ref': self.name,
+            'invoice_line_ids': line_commands,
+        }
+
+    def _create_therapy_invoices(self):
+        """Create one therapy invoice per appointment of self in a single
+        account.move create.
+
+        Appointments that cannot be invoiced are skipped and reported rather
+        than aborting the batch. Returns (invoices, errors) where errors maps
+        each skipped appointment id to its message.
+        """
+        sale_journal = self.env['account.journal'].search([('type', '=', 'sale')], limit=1)
+        if not sale_journal:
+            raise UserError(_('No sale journal found. Please configure a sale journal.'))
+
+        # active_ids may repeat a record: build a single invoice per appointment
+        appointments = self.browse(unique(self.ids))
+        # Warm the cache for the whole batch before building the vals
+        appointments.mapped('patient_id.patient_id.property_account_position_id')
+
+        errors = {}
+        vals_list = []
+        to_invoice = self.browse()
+        for appointment in appointments:
+            try:
+                vals_list.append(appointment._prepare_therapy_invoice_vals(sale_journal))
+            except UserError as e:
+                errors[appointment.id] = e.args[0]
+                continue
+            to_invoice |= appointment
+
+        names = self.env['ir.sequence']._next_by_code_batch('medical_app_therapy_inv_seq', len(vals_list))
+        for vals, name in zip(vals_list, names):
+            vals['name'] = name
+        invoices = self.env['account.move'].create(vals_list)
+        for appointment, invoice in zip(to_invoice, invoices):
+            appointment.write({
+                'is_invoiced': True,
+                'invoice_id': invoice.id
+            })
+        return invoices, errors
+
+    @profiled()
     def create_invoice(self):
         """Create invoice based on therapy types with commission calculation"""
         self.ensure_one()
@@ -236,46 +438,19 @@ class medical_appointment(models.Model):
             'ref': self.name,
         }
         
-        account_invoice_obj = self.env['account.move']
-        invoice = account_invoice_obj.create(invoice_vals)
-        
         # Create invoice lines for each therapy
+        line_commands = []
         for therapy in self.therapy_ids:
             if not therapy.product_id:
                 raise UserError(_('No product associated with therapy %s. Please configure product for this therapy type.') % therapy.name)
-            
-            # Get income account for the product
-            invoice_line_account_id = False
-            if therapy.product_id.id:
-                invoice_line_account_id = (therapy.product_id.property_account_income_id.id or 
-                                         therapy.product_id.categ_id.property_account_income_categ_id.id or 
-                                         False)
-            
-            if not invoice_line_account_id:
-                raise UserError(
-                    _('There is no income account defined for product: "%s". You may have to install a chart of account from Accounting app, settings menu.') %
-                    (therapy.product_id.name,))
-            
-            # Get taxes
-            tax_ids = []
-            taxes = therapy.product_id.taxes_id.filtered(
-                lambda r: not therapy.product_id.company_id or r.company_id == therapy.product_id.company_id)
-            tax_ids = taxes.ids
-            
-            # Create invoice line
-            invoice_line_vals = {
-                'name': therapy.product_id.name or '',
-                'account_id': invoice_line_account_id,
-                'price_unit': therapy.product_id.list_price,
-                'product_uom_id': therapy.product_id.uom_id.id,
-                'quantity': 1,
-                'product_id': therapy.product_id.id,
-                'tax_ids': [(6, 0, tax_ids)],
-                'therapy_type_id': therapy.id,  # Link to therapy type for commission calculation
-            }
-            
-            # Add line to invoice
-            invoice.write({'invoice_line_ids': [(0, 0, invoice_line_vals)]})
+            line_commands.append(Command.create(dict(
+                therapy.product_id._get_medical_invoice_line_template(),
+                quantity=1,
+                therapy_type_id=therapy.id,  # Link to therapy type for commission calculation
+            )))
+        invoice_vals['invoice_line_ids'] = line_commands
+
+        invoice = self.env['account.move'].create(invoice_vals)
         
         # Mark appointment as invoiced
         self.write({
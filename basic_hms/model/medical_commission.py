@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from bisect import bisect_right
+from datetime import date
+
+from odoo import api, fields, models
+
+COMMISSION_TYPES = [
+    ('fixed', 'Fixed Amount'),
+    ('percentage', 'Percentage'),
+]
+
+
+class TherapyCommissionRate(models.Model):
+    """Commission rate of a therapy type, valid from date_from until the
+    next version. Posted invoices keep the rate of their accounting date."""
+    _name = 'therapy.commission.rate'
+    _description = 'Therapy Commission Rate'
+    _order = 'therapy_type_id, date_from desc, id desc'
+
+    therapy_type_id = fields.Many2one('therapy.type', string='Therapy Type', required=True,
+                                      ondelete='cascade', index=True)
+    date_from = fields.Date(string='Valid From', help='Leave empty for a rate valid since the beginning.')
+    commission_type = fields.Selection(COMMISSION_TYPES, string='Commission Type', required=True, default='fixed')
+    commission_value = fields.Float(string='Commission Value', required=True)
+
+    def init(self):
+        # Therapy types created before rates were versioned keep their
+        # settings as a rate valid since the beginning
+        self.env.cr.execute("""
+            INSERT INTO therapy_commission_rate (therapy_type_id, commission_type, commission_value,
+                                                 create_uid, create_date, write_uid, write_date)
+            SELECT therapy.id, COALESCE(therapy.commission_type, 'fixed'), COALESCE(therapy.commission_value, 0.0),
+                   %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+              FROM therapy_type therapy
+             WHERE NOT EXISTS (SELECT 1 FROM therapy_commission_rate rate WHERE rate.therapy_type_id = therapy.id)
+        """, {'uid': self.env.uid})
+
+    @api.model
+    def _get_rate_table(self, therapy_types):
+        """Return {therapy.type id: ([valid from], [rate])}, both lists sorted
+        by validity, for lookups with _find_rate."""
+        table = {}
+        for rate in self.search([('therapy_type_id', 'in', therapy_types.ids)]).sorted(
+                lambda rate: (rate.date_from or date.min, rate.id)):
+            dates, rates = table.setdefault(rate.therapy_type_id.id, ([], []))
+            dates.append(rate.date_from or date.min)
+            rates.append(rate)
+        return table
+
+    @api.model
+    def _find_rate(self, rate_table, therapy, on_date):
+        """Return the rate of therapy valid on on_date, or an empty recordset."""
+        dates, rates = rate_table.get(therapy.id, ([], []))
+        index = bisect_right(dates, on_date)
+        return rates[index - 1] if index else self.browse()
+
+
+class MedicalCommissionLine(models.Model):
+    """Commission ledger: one entry per therapy line of the posted invoices,
+    written when the invoice is posted and removed when it is reset to draft."""
+    _name = 'medical.commission.line'
+    _description = 'Commission Ledger Entry'
+    _order = 'date desc, id desc'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one('account.move', string='Invoice', required=True, ondelete='cascade', index=True, readonly=True)
+    move_line_id = fields.Many2one('account.move.line', string='Invoice Line', required=True, ondelete='cascade', readonly=True)
+    therapy_type_id = fields.Many2one('therapy.type', string='Therapy Type', required=True, index=True, readonly=True)
+    rate_id = fields.Many2one('therapy.commission.rate', string='Rate', ondelete='set null', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Patient', readonly=True)
+    date = fields.Date(string='Date', required=True, index=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    commission_type = fields.Selection(COMMISSION_TYPES, string='Commission Type', readonly=True)
+    commission_value = fields.Float(string='Commission Value', readonly=True, aggregator=None)
+    base_amount = fields.Monetary(string='Base Amount', readonly=True)
+    commission = fields.Monetary(string='Commission', readonly=True)
+
+    _sql_constraints = [
+        ('move_line_uniq', 'unique(move_line_id)', 'An invoice line has a single commission entry.'),
+    ]
+
+    @api.model
+    def _generate_for_moves(self, moves, therapy_types=None):
+        """Create the ledger entries of the therapy lines of the given posted
+        moves in one batch, with the rates valid on their accounting date."""
+        domain = [('move_id', 'in', moves.ids), ('therapy_type_id', '!=', False)]
+        if therapy_types:
+            domain.append(('therapy_type_id', 'in', therapy_types.ids))
+        lines = self.env['account.move.line'].sudo().search(domain)
+        if not lines:
+            return self.browse()
+        Rate = self.env['therapy.commission.rate'].sudo()
+        rate_table = Rate._get_rate_table(lines.therapy_type_id)
+        vals_list = []
+        for line in lines:
+            if not (line.price_unit and line.quantity):
+                continue
+            move = line.move_id
+            therapy = line.therapy_type_id
+            rate = Rate._find_rate(rate_table, therapy, move.date)
+            commission_type = rate.commission_type if rate else therapy.commission_type
+            commission_value = rate.commission_value if rate else therapy.commission_value
+            base_amount = line.price_unit * line.quantity
+            if commission_type == 'fixed':
+                commission = commission_value
+            else:
+                commission = base_amount * commission_value / 100.0
+            # Refunds take the commission back
+            sign = -1 if move.move_type == 'out_refund' else 1
+            vals_list.append({
+                'move_id': move.id,
+                'move_line_id': line.id,
+                'therapy_type_id': therapy.id,
+                'rate_id': rate.id,
+                'partner_id': move.partner_id.id,
+                'date': move.date,
+                'company_id': move.company_id.id,
+                'currency_id': move.currency_id.id,
+                'commission_type': commission_type,
+                'commission_value': commission_value,
+                'base_amount': sign * base_amount,
+                'commission': sign * commission,
+            })
+        return self.sudo().create(vals_list)
+
+    @api.model
+    def _recompute_period(self, date_from=None, date_to=None, therapy_types=None):
+        """Rebuild the ledger of the posted moves of a period, e.g. after a
+        rate correction. Returns the new entries."""
+        domain = [('state', '=', 'posted'), ('line_ids.therapy_type_id', '!=', False)]
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        moves = self.env['account.move'].sudo().search(domain)
+        entries = self.sudo().search([('move_id', 'in', moves.ids)])
+        if therapy_types:
+            entries = entries.filtered(lambda entry: entry.therapy_type_id in therapy_types)
+        entries.unlink()
+        entries = self._generate_for_moves(moves, therapy_types)
+        self.env['medical.revenue.cube']._refresh_for_moves(moves)
+        return entries
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from psycopg2 import errors
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .medical_action_profile import profiled
+
+_logger = logging.getLogger(__name__)
+
+# Errors of concurrent transactions, which a retry can resolve
+PG_CONCURRENCY_ERRORS = (errors.LockNotAvailable, errors.SerializationFailure, errors.DeadlockDetected)
+
+
+class MedicalInvoiceJob(models.Model):
+    """Background invoicing run.
+
+    A job holds one item per record to process (appointment, patient, ...).
+    The cron processes pending items chunk by chunk and commits after each
+    chunk, so a crash or a timeout only loses the chunk in progress: the
+    next cron run resumes from the remaining pending items.
+    """
+    _name = 'medical.invoice.job'
+    _description = 'Medical Invoicing Job'
+    _order = 'id desc'
+
+    name = fields.Char(string='Name', required=True)
+    job_type = fields.Selection([
+        ('therapy_invoice', 'Therapy Invoices'),
+    ], string='Job Type', required=True)
+    res_model = fields.Char(string='Model', required=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Done with Errors'),
+    ], string='State', default='pending', required=True)
+    chunk_size = fields.Integer(string='Chunk Size', default=100)
+    item_ids = fields.One2many('medical.invoice.job.item', 'job_id', string='Items')
+    invoice_ids = fields.Many2many('account.move', string='Invoices', readonly=True)
+    item_count = fields.Integer(string='Items', compute='_compute_progress')
+    done_count = fields.Integer(string='Processed', compute='_compute_progress')
+    error_count = fields.Integer(string='Errors', compute='_compute_progress')
+    progress = fields.Float(string='Progress', compute='_compute_progress')
+    date_start = fields.Datetime(string='Started On', readonly=True)
+    date_end = fields.Datetime(string='Finished On', readonly=True)
+
+    @api.depends('item_ids.state')
+    def _compute_progress(self):
+        groups = self.env['medical.invoice.job.item']._read_group(
+            [('job_id', 'in', self._origin.ids)], ['job_id', 'state'], ['__count'])
+        counts = {}
+        for job, state, count in groups:
+            counts.setdefault(job.id, {})[state] = count
+        for job in self:
+            job_counts = counts.get(job._origin.id, {})
+            job.item_count = sum(job_counts.values())
+            job.done_count = job_counts.get('done', 0)
+            job.error_count = job_counts.get('error', 0)
+            processed = job.done_count + job.error_count
+            job.progress = (processed * 100.0 / job.item_count) if job.item_count else 0.0
+
+    @api.model
+    def _create_job(self, job_type, records, name=None):
+        """Queue records for background processing and wake up the cron."""
+        if not records:
+            raise UserError(_('Nothing to process.'))
+        job = self.create({
+            'name': name or dict(self._fields['job_type']._description_selection(self.env))[job_type],
+            'job_type': job_type,
+            'res_model': records._name,
+            'item_ids': [(0, 0, {'res_id': res_id}) for res_id in records.ids],
+        })
+        cron = self.env.ref('basic_hms.ir_cron_medical_invoice_job', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return job
+
+    @api.model
+    @profiled()
+    def _cron_process_jobs(self):
+        """Process every pending or interrupted job."""
+        for job in self.search([('state', 'in', ('pending', 'running'))], order='id'):
+            job._process(auto_commit=True)
+
+    @profiled()
+    def action_process(self):
+        """Run the job right away in the current request."""
+        for job in self:
+            if not job._process(auto_commit=False):
+                raise UserError(_('The job %s is already being processed. Please try again later.') % job.name)
+
+    def action_retry_errors(self):
+        """Put failed items back in the queue."""
+        self.item_ids.filtered(lambda item: item.state == 'error').write({'state': 'pending', 'message': False})
+        self.write({'state': 'pending', 'date_end': False})
+        cron = self.env.ref('basic_hms.ir_cron_medical_invoice_job', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def _try_lock(self):
+        """Lock the job row until the end of the transaction. Return False if
+        another transaction (the cron or a "Run Now") is processing it."""
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("SELECT id FROM medical_invoice_job WHERE id = %s FOR UPDATE NOWAIT", [self.id])
+        except errors.LockNotAvailable:
+            return False
+        # Another run may have moved the job on before we got the lock
+        self.invalidate_recordset(['state'])
+        return True
+
+    def _process(self, auto_commit=False):
+        """Process the pending items of the job, chunk by chunk. Return False
+        when the job is already being processed by another transaction."""
+        self.ensure_one()
+        Item = self.env['medical.invoice.job.item']
+        if not self._try_lock():
+            return False
+        if self.state == 'pending':
+            self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+            if auto_commit:
+                self.env.cr.commit()
+                # A commit releases the lock
+                if not self._try_lock():
+                    return False
+        runner = getattr(self, '_run_%s' % self.job_type)
+        while True:
+            items = Item.search([('job_id', '=', self.id), ('state', '=', 'pending')],
+                                limit=max(self.chunk_size, 1), order='id')
+            if not items:
+                break
+            records = self.env[self.res_model].browse(items.mapped('res_id')).exists()
+            existing_ids = set(records.ids)
+            try:
+                with self.env.cr.savepoint():
+                    invoices, errors_by_id = runner(records)
+            except PG_CONCURRENCY_ERRORS:
+                # Transient: let the transaction be retried rather than
+                # flagging the items as failed
+                raise
+            except Exception as e:
+                # The whole chunk is rolled back: flag every item of it
+                _logger.exception('Invoicing job %s failed on a chunk', self.id)
+                invoices, errors_by_id = self.env['account.move'], {rid: str(e) for rid in items.mapped('res_id')}
+            done = Item
+            failed = {}
+            for item in items:
+                if item.res_id in errors_by_id:
+                    failed.setdefault(errors_by_id[item.res_id], []).append(item.id)
+                elif item.res_id in existing_ids:
+                    done |= item
+                else:
+                    failed.setdefault(_('Record no longer exists.'), []).append(item.id)
+            done.write({'state': 'done'})
+            for message, item_ids in failed.items():
+                Item.browse(item_ids).write({'state': 'error', 'message': message})
+            if invoices:
+                self.write({'invoice_ids': [(4, invoice_id) for invoice_id in invoices.ids]})
+            if auto_commit:
+                self.env.cr.commit()
+                if not self._try_lock():
+                    return False
+        has_errors = bool(Item.search_count([('job_id', '=', self.id), ('state', '=', 'error')]))
+        self.write({
+            'state': 'failed' if has_errors else 'done',
+            'date_end': fields.Datetime.now(),
+        })
+        if auto_commit:
+            self.env.cr.commit()
+        return True
+
+    def _run_therapy_invoice(self, appointments):
+        """Return (invoices, {appointment id: error}) for the given chunk."""
+        return appointments._create_therapy_invoices()
+
+    def action_view_invoices(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Invoices'),
+            'res_model': 'account.move',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', self.invoice_ids.ids)],
+            'context': {'create': False},
+        }
+
+
+class MedicalInvoiceJobItem(models.Model):
+    _name = 'medical.invoice.job.item'
+    _description = 'Medical Invoicing Job Item'
+    _order = 'id'
+
+    job_id = fields.Many2one('medical.invoice.job', string='Job', required=True, ondelete='cascade', index=True)
+    res_id = fields.Integer(string='Record ID', required=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('error', 'Error'),
+    ], string='State', default='pending', required=True, index=True)
+    message = fields.Text(string='Message')
@@ -6,6 +6,19 @@ from datetime import date,datetime
 from dateutil.relativedelta import relativedelta
 from odoo.exceptions import UserError, ValidationError
 
+# (medical.patient field, res.partner field) kept in sync on the patient partner
+PARTNER_SYNC_FIELDS = [
+    ('mobile', 'mobile'),
+    ('phone', 'phone'),
+    ('email', 'email'),
+    ('street', 'street'),
+    ('street2', 'street2'),
+    ('city', 'city'),
+    ('state_id', 'state_id'),
+    ('zip_code', 'zip'),
+    ('country_id', 'country_id'),
+]
+
 class medical_patient(models.Model):
     
     _name = 'medical.patient'
@@ -133,25 +146,45 @@ class medical_patient(models.Model):
     email = fields.Char(string="Email", readonly=False, tracking=True)
     height = fields.Char(string="Height", tracking=True)
     weight = fields.Char(string="Weight", tracking=True)
-    appointment_count = fields.Integer(string="Appointments", compute="_compute_appointment_count", default=0)
+    appointment_count = fields.Integer(string="Appointments", compute="_compute_appointment_count", store=True, default=0)
     invoice_count = fields.Integer(string="Invoices", compute="_compute_invoice_count", default=0)
 
+    @api.depends('medical_appointments_ids')
     def _compute_appointment_count(self):
+        """Stored counter, kept up to date by the ORM whenever a visit is
+        created, deleted or moved to another patient."""
+        counts = self._get_appointment_counts()
         for record in self:
-            record.appointment_count = self.env['medical.appointment'].search_count([('patient_id', '=', record.id)])
+            record.appointment_count = counts.get(record._origin.id, 0)
 
     @api.depends('patient_id')
     def _compute_invoice_count(self):
         """Compute the number of invoices for this patient"""
+        counts = self._get_invoice_counts()
         for rec in self:
-            if rec.patient_id:
-                invoices = self.env['account.move'].search([
-                    ('partner_id', '=', rec.patient_id.id),
-                    ('move_type', 'in', ['out_invoice', 'out_refund'])
-                ])
-                rec.invoice_count = len(invoices)
-            else:
-                rec.invoice_count = 0
+            rec.invoice_count = counts.get(rec.patient_id.id, 0) if rec.patient_id else 0
+
+    def _get_appointment_counts(self):
+        """Return {medical.patient id: appointment count} for the whole
+        recordset with a single grouped query."""
+        patient_ids = self._origin.ids
+        if not patient_ids:
+            return {}
+        groups = self.env['medical.appointment']._read_group(
+            [('patient_id', 'in', patient_ids)], ['patient_id'], ['__count'])
+        return {patient.id: count for patient, count in groups}
+
+    def _get_invoice_counts(self):
+        """Return {res.partner id: customer invoice/refund count} for the
+        partners of the whole recordset with a single grouped query."""
+        partner_ids = self.patient_id.ids
+        if not partner_ids:
+            return {}
+        groups = self.env['account.move']._read_group([
+            ('partner_id', 'in', partner_ids),
+            ('move_type', 'in', ['out_invoice', 'out_refund']),
+        ], ['partner_id'], ['__count'])
+        return {partner.id: count for partner, count in groups}
 
     def action_open_appointments(self):
         self.ensure_one()
@@ -213,17 +246,17 @@ class medical_patient(models.Model):
         Override create method to sync patient_name with res.partner
         Parent method is called first for efficiency and proper record creation
         """
-        # Handle name generation and age calculation before creating records
+        # Reserve the patient IDs of the whole batch at once
+        unnamed = [val for val in vals_list if not val.get('name')]
+        patient_ids = self.env['ir.sequence']._next_by_code_batch('medical.patient', len(unnamed))
+        for val, patient_id in zip(unnamed, patient_ids):
+            if patient_id:
+                val.update({
+                    'name': f"SPNIC-{patient_id}"
+                })
+
+        # Handle age calculation before creating records
         for val in vals_list:
-            # Generate patient ID if not provided
-            if not val.get('name'):
-                today_str = datetime.today().strftime("%d%m%y")
-                patient_id = self.env['ir.sequence'].next_by_code('medical.patient')
-                if patient_id:
-                    val.update({
-                        'name': f"SPNIC-{patient_id}"
-                    })
-            
             # Calculate age if date_of_birth is provided
             if val.get('date_of_birth'):
                 dt = val.get('date_of_birth')
@@ -233,53 +266,34 @@ class medical_patient(models.Model):
                 age = str(rd.years) + "y" + " " + str(rd.months) + "m" + " " + str(rd.days) + "d"
                 val.update({'age': age})
         
+        # Create the partners of the new patients in a single batch
+        to_link = [val for val in vals_list if val.get('patient_name') and not val.get('patient_id')]
+        partners = self.env['res.partner'].create([
+            self._prepare_patient_partner_vals(val['patient_name'], val) for val in to_link])
+        for val, partner in zip(to_link, partners):
+            val['patient_id'] = partner.id
+
         # Call parent method first to create the records
         res = super(medical_patient, self).create(vals_list)
-        
-        # Now handle the synchronization logic for created records
+
+        # Handle existing patient_id - sync patient_name, one write per name
+        partners_by_name = {}
         for record in res:
-            # Handle patient_name synchronization with res.partner
-            if record.patient_name and not record.patient_id:
-                # Create new res.partner if patient_name is provided but no patient_id
-                partner_vals = {
-                    'name': record.patient_name,
-                }
-                partner_vals = self._ensure_patient_partner(partner_vals)
-                # Add related fields if provided
-                if record.mobile:
-                    partner_vals['mobile'] = record.mobile
-                if record.phone:
-                    partner_vals['phone'] = record.phone
-                if record.email:
-                    partner_vals['email'] = record.email
-                if record.street:
-                    partner_vals['street'] = record.street
-                if record.street2:
-                    partner_vals['street2'] = record.street2
-                if record.city:
-                    partner_vals['city'] = record.city
-                if record.state_id:
-                    partner_vals['state_id'] = record.state_id.id
-                if record.zip_code:
-                    partner_vals['zip'] = record.zip_code
-                if record.country_id:
-                    partner_vals['country_id'] = record.country_id.id
-                
-                partner = self.env['res.partner'].create(partner_vals)
+            if record.patient_id and record.patient_name and record.patient_id.name != record.patient_name:
+                partners_by_name.setdefault(record.patient_name, self.env['res.partner'])
+                partners_by_name[record.patient_name] |= record.patient_id
+        for name, partners in partners_by_name.items():
+            partners.write({'name': name})
+
+        # Handle appointment context (existing logic)
+        appointment = self._context.get('appointment_id')
+        if appointment:
+            records = res.filtered('patient_id')
+            partners = self.env['res.partner'].create([
+                {'name': record.patient_id.name} for record in records])
+            for record, partner in zip(records, partners):
                 record.patient_id = partner.id
-            
-            # Handle existing patient_id - sync patient_name
-            elif record.patient_id and record.patient_name:
-                if record.patient_id.name != record.patient_name:
-                    record.patient_id.write({'name': record.patient_name})
-            
-            # Handle appointment context (existing logic)
-            appointment = self._context.get('appointment_id')
-            if appointment and record.patient_id:
-                val_1 = {'name': record.patient_id.name}
-                patient = self.env['res.partner'].create(val_1)
-                record.patient_id = patient.id
-        
+
         return res
 
     def write(self, vals):
@@ -289,68 +303,49 @@ class medical_patient(models.Model):
         """
         # Call parent method first to update the records
         res = super(medical_patient, self).write(vals)
-        
+
         # Now handle the synchronization logic for updated records
-        for record in self:
-            # Sync patient_name with res.partner
-            if vals.get('patient_name') and record.patient_id:
-                partner_vals = {'name': vals.get('patient_name')}
-                
-                # Sync related fields if they are being updated
-                if vals.get('mobile'):
-                    partner_vals['mobile'] = vals.get('mobile')
-                if vals.get('phone'):
-                    partner_vals['phone'] = vals.get('phone')
-                if vals.get('email'):
-                    partner_vals['email'] = vals.get('email')
-                if vals.get('street'):
-                    partner_vals['street'] = vals.get('street')
-                if vals.get('street2'):
-                    partner_vals['street2'] = vals.get('street2')
-                if vals.get('city'):
-                    partner_vals['city'] = vals.get('city')
-                if vals.get('state_id'):
-                    partner_vals['state_id'] = vals.get('state_id')
-                if vals.get('zip_code'):
-                    partner_vals['zip'] = vals.get('zip_code')
-                if vals.get('country_id'):
-                    partner_vals['country_id'] = vals.get('country_id')
-                
-                # Update the partner
-                record.patient_id.write(partner_vals)
-            
-            # Handle case where patient_name is updated but no patient_id exists
-            elif vals.get('patient_name') and not record.patient_id:
-                # Create new res.partner
-                partner_vals = {
-                    'name': vals.get('patient_name'),
-                }
-                partner_vals = self._ensure_patient_partner(partner_vals)
-                # Add related fields if provided
-                if vals.get('mobile'):
-                    partner_vals['mobile'] = vals.get('mobile')
-                if vals.get('phone'):
-                    partner_vals['phone'] = vals.get('phone')
-                if vals.get('email'):
-                    partner_vals['email'] = vals.get('email')
-                if vals.get('street'):
-                    partner_vals['street'] = vals.get('street')
-                if vals.get('street2'):
-                    partner_vals['street2'] = vals.get('street2')
-                if vals.get('city'):
-                    partner_vals['city'] = vals.get('city')
-                if vals.get('state_id'):
-                    partner_vals['state_id'] = vals.get('state_id')
-                if vals.get('zip_code'):
-                    partner_vals['zip'] = vals.get('zip_code')
-                if vals.get('country_id'):
-                    partner_vals['country_id'] = vals.get('country_id')
-                
-                partner = self.env['res.partner'].create(partner_vals)
-                record.patient_id = partner.id
-        
+        if not vals.get('patient_name'):
+            return res
+
+        # Sync patient_name and the related fields being updated with
+        # res.partner: only the fields that differ are written, and partners
+        # with the same changes are written together
+        partner_vals = self._prepare_patient_partner_vals(vals['patient_name'], vals, as_person=False)
+        partner_fields = self.env['res.partner']._fields
+        changes = {}
+        for partner in self.patient_id:
+            changed = tuple(sorted(
+                (fname, value) for fname, value in partner_vals.items()
+                if partner_fields[fname].convert_to_write(partner[fname], partner) != value
+            ))
+            if changed:
+                changes.setdefault(changed, self.env['res.partner'])
+                changes[changed] |= partner
+        for changed, partners in changes.items():
+            partners.write(dict(changed))
+
+        # Handle case where patient_name is updated but no patient_id exists
+        records = self.filtered(lambda record: not record.patient_id)
+        partners = self.env['res.partner'].create([
+            self._prepare_patient_partner_vals(vals['patient_name'], vals) for _record in records])
+        for record, partner in zip(records, partners):
+            record.patient_id = partner.id
+
         return res
 
+    @api.model
+    def _prepare_patient_partner_vals(self, name, vals, as_person=True):
+        """Return the res.partner vals mirroring the patient vals: the name
+        and the related fields provided."""
+        partner_vals = {'name': name}
+        if as_person:
+            partner_vals = self._ensure_patient_partner(partner_vals)
+        for patient_field, partner_field in PARTNER_SYNC_FIELDS:
+            if vals.get(patient_field):
+                partner_vals[partner_field] = vals[patient_field]
+        return partner_vals
+
     @api.constrains('date_of_death')
     def _check_date_death(self):
         for rec in self:
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.sql import create_unique_index
+
+CUBE_GROUPBYS = {
+    'date': 'date:day',
+    'week': 'date:week',
+    'month': 'date:month',
+    'year': 'date:year',
+    'therapy_type': 'therapy_type_id',
+    'doctor': 'doctor_id',
+    'patient': 'patient_id',
+    'company': 'company_id',
+    'currency': 'currency_id',
+}
+CUBE_MEASURES = ('session_count', 'revenue', 'commission')
+
+
+class MedicalRevenueCube(models.Model):
+    """Therapy revenue and commission of the posted invoices, aggregated per
+    day, therapy type, doctor and patient.
+
+    The table is maintained by the invoices themselves: posting or resetting
+    an invoice to draft rebuilds the cells of its accounting days, so reports
+    never scan account.move.line.
+    """
+    _name = 'medical.revenue.cube'
+    _description = 'Therapy Revenue Analysis'
+    _order = 'date desc, id desc'
+    _rec_name = 'date'
+
+    date = fields.Date(string='Date', required=True, index=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    therapy_type_id = fields.Many2one('therapy.type', string='Therapy Type', readonly=True, ondelete='cascade')
+    doctor_id = fields.Many2one('medical.physician', string='Doctor', readonly=True, ondelete='set null')
+    patient_id = fields.Many2one('medical.patient', string='Patient', readonly=True, ondelete='set null')
+    session_count = fields.Integer(string='Sessions', readonly=True)
+    revenue = fields.Monetary(string='Revenue', readonly=True)
+    commission = fields.Monetary(string='Commission', readonly=True)
+
+    def init(self):
+        create_unique_index(self.env.cr, 'medical_revenue_cube_cell_uniq', self._table, [
+            'date', 'company_id', 'COALESCE(currency_id, 0)', 'COALESCE(therapy_type_id, 0)',
+            'COALESCE(doctor_id, 0)', 'COALESCE(patient_id, 0)',
+        ])
+
+    @api.model
+    def _refresh_for_moves(self, moves):
+        """Rebuild the cells of the accounting days of moves."""
+        if not moves:
+            return
+        days = {(move.company_id.id, move.date) for move in moves.sudo() if move.date}
+        self._refresh_days(days)
+
+    @api.model
+    def _refresh_days(self, days):
+        """Rebuild the cells of the given (company id, date) pairs from the
+        posted invoices and the commission ledger."""
+        if not days:
+            return
+        self.env['account.move'].flush_model(['date', 'state', 'company_id', 'currency_id', 'move_type', 'reversed_entry_id'])
+        self.env['account.move.line'].flush_model(['move_id', 'therapy_type_id', 'price_subtotal', 'quantity'])
+        self.env['medical.appointment'].flush_model(['invoice_id', 'doctor_id', 'patient_id'])
+        self.env['medical.commission.line'].flush_model(['move_line_id', 'commission'])
+        cr = self.env.cr
+        days = sorted(days)
+        # Invoices of the same day posted concurrently must not both rebuild
+        # its cells from their own snapshot
+        for company_id, day in days:
+            cr.execute(SQL("SELECT pg_advisory_xact_lock(hashtext(%s), %s)",
+                           'medical_revenue_cube:%s' % company_id, day.toordinal()))
+        company_ids = [company_id for company_id, _day in days]
+        dates = [day for _company_id, day in days]
+        cr.execute(SQL("""
+            DELETE FROM medical_revenue_cube cube
+             USING unnest(%s::int[], %s::date[]) AS day(company_id, date)
+             WHERE cube.company_id = day.company_id AND cube.date = day.date
+        """, company_ids, dates))
+        cr.execute(SQL("""
+            INSERT INTO medical_revenue_cube (date, company_id, currency_id, therapy_type_id, doctor_id, patient_id,
+                                              session_count, revenue, commission,
+                                              create_uid, create_date, write_uid, write_date)
+            SELECT move.date, move.company_id, move.currency_id, line.therapy_type_id,
+                   apt.doctor_id, apt.patient_id,
+                   SUM(sign.value * line.quantity),
+                   SUM(sign.value * line.price_subtotal),
+                   SUM(COALESCE(commission.commission, 0.0)),
+                   %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+              FROM unnest(%(companies)s::int[], %(dates)s::date[]) AS day(company_id, date)
+              JOIN account_move move ON move.company_id = day.company_id AND move.date = day.date
+              JOIN account_move_line line ON line.move_id = move.id AND line.therapy_type_id IS NOT NULL
+         LEFT JOIN medical_commission_line commission ON commission.move_line_id = line.id
+         LEFT JOIN LATERAL (
+                    SELECT appointment.doctor_id, appointment.patient_id
+                      FROM medical_appointment appointment
+                     WHERE appointment.invoice_id = COALESCE(move.reversed_entry_id, move.id)
+                  ORDER BY appointment.id
+                     LIMIT 1
+                   ) AS apt ON TRUE
+             CROSS JOIN LATERAL (
+                    SELECT CASE WHEN move.move_type = 'out_refund' THEN -1 ELSE 1 END AS value
+                   ) AS sign
+             WHERE move.state = 'posted'
+               AND move.move_type IN ('out_invoice', 'out_refund')
+          GROUP BY move.date, move.company_id, move.currency_id, line.therapy_type_id, apt.doctor_id, apt.patient_id
+        """, uid=self.env.uid, companies=company_ids, dates=dates))
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_period(self, date_from=None, date_to=None):
+        """Rebuild the cells of every day of the period that has or had
+        posted therapy invoices."""
+        domain = [('state', '=', 'posted'), ('line_ids.therapy_type_id', '!=', False)]
+        cube_domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+            cube_domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+            cube_domain.append(('date', '<=', date_to))
+        days = {(company.id, day) for company, day in self.env['account.move'].sudo()._read_group(
+            domain, ['company_id', 'date:day'])}
+        days.update((company.id, day) for company, day in self.sudo()._read_group(
+            cube_domain, ['company_id', 'date:day']))
+        self._refresh_days(days)
+
+    @api.model
+    def action_rebuild(self):
+        self.check_access('write')
+        self._refresh_period()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+    @api.model
+    def get_dashboard_data(self, groupby=('month',), date_from=None, date_to=None,
+                           therapy_type_ids=None, doctor_ids=None, patient_ids=None):
+        """Aggregate the cube for dashboards: return a list of dicts holding
+        the groupby keys (ids and display names) and the measures.
+
+        Amounts are never summed across currencies: the rows are always
+        grouped by currency as well, and hold its id and name."""
+        unknown = set(groupby) - set(CUBE_GROUPBYS)
+        if unknown:
+            raise UserError(_('Unknown grouping: %s. Use one of %s.') % (
+                ', '.join(sorted(unknown)), ', '.join(CUBE_GROUPBYS)))
+        domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        if therapy_type_ids:
+            domain.append(('therapy_type_id', 'in', therapy_type_ids))
+        if doctor_ids:
+            domain.append(('doctor_id', 'in', doctor_ids))
+        if patient_ids:
+            domain.append(('patient_id', 'in', patient_ids))
+        groupby = list(groupby)
+        if 'currency' not in groupby:
+            groupby.append('currency')
+        specs = [CUBE_GROUPBYS[key] for key in groupby]
+        rows = self._read_group(domain, specs, ['%s:sum' % measure for measure in CUBE_MEASURES],
+                                order=', '.join(specs) or None)
+        result = []
+        for row in rows:
+            values = {}
+            for key, value in zip(groupby, row):
+                if isinstance(value, models.BaseModel):
+                    values[key] = value.id or False
+                    values['%s_name' % key] = value.display_name or False
+                else:
+                    values[key] = fields.Date.to_string(value) if value else False
+            values.update(zip(CUBE_MEASURES, (value or 0 for value in row[len(groupby):])))
+            result.append(values)
+        return result
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
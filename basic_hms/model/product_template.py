@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, models, Command, _
+from odoo.exceptions import UserError
+from odoo.tools import ormcache
+
+# Per-transaction cache of the invoice line templates, in env.cr.cache
+LINE_TEMPLATE_CACHE = 'basic_hms.invoice_line_templates'
+LINE_ACCOUNTING_FIELDS = {'property_account_income_id', 'taxes_id', 'categ_id', 'uom_id', 'company_id'}
+
+
+def _clear_line_template_caches(env):
+    env.cr.cache.pop(LINE_TEMPLATE_CACHE, None)
+    env.registry.clear_cache()
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    @api.model
+    @ormcache('product_id', 'company_id')
+    def _get_medical_line_accounting(self, product_id, company_id):
+        """Return (income account id, tax ids, uom id) of the invoice lines of
+        product_id in company_id. Cached until a product, a product category
+        or a tax changes."""
+        product = self.sudo().with_company(company_id).browse(product_id)
+        account_id = product.property_account_income_id.id or \
+            product.categ_id.property_account_income_categ_id.id
+        if not account_id:
+            raise UserError(
+                _('There is no income account defined for product: "%s". You may have to install a chart of account from Accounting app, settings menu.') %
+                (product.name,))
+        # Read as superuser: keep only the taxes of the target company (or
+        # of its parents), as the record rules of the user would
+        taxes = product.taxes_id._filter_taxes_by_company(self.env['res.company'].browse(company_id))
+        return account_id, tuple(taxes.ids), product.uom_id.id
+
+    def _get_medical_invoice_line_template(self):
+        """Return the invoice line values shared by every line of this
+        product, resolved once per transaction and company. The name is read
+        on each call, in the language of the environment."""
+        self.ensure_one()
+        templates = self.env.cr.cache.setdefault(LINE_TEMPLATE_CACHE, {})
+        key = (self.id, self.env.company.id)
+        if key not in templates:
+            account_id, tax_ids, uom_id = self._get_medical_line_accounting(self.id, self.env.company.id)
+            templates[key] = {
+                'account_id': account_id,
+                'price_unit': self.list_price,
+                'product_uom_id': uom_id,
+                'product_id': self.id,
+                'tax_ids': [Command.set(list(tax_ids))],
+            }
+        return dict(templates[key], name=self.name or '')
+
+    def write(self, vals):
+        res = super().write(vals)
+        if LINE_ACCOUNTING_FIELDS.intersection(vals):
+            _clear_line_template_caches(self.env)
+        elif 'list_price' in vals:
+            self.env.cr.cache.pop(LINE_TEMPLATE_CACHE, None)
+        return res
+
+
+class ProductCategory(models.Model):
+    _inherit = 'product.category'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'property_account_income_categ_id' in vals:
+            _clear_line_template_caches(self.env)
+        return res
+
+
+class AccountTax(models.Model):
+    _inherit = 'account.tax'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'company_id' in vals or 'active' in vals:
+            _clear_line_template_caches(self.env)
+        return res
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
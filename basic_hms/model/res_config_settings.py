@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, fields, models
+
+NUMBERING_SEQUENCES = ['basic_hms.medical_appointment_code_sequence', 'basic_hms.patient_registration_sequence']
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    medical_profiling = fields.Boolean(string='Profile Hospital Actions',
+        config_parameter='basic_hms.profiling',
+        help='Log the query count and timings of every call of the hospital actions.')
+    medical_sequence_implementation = fields.Selection([
+        ('standard', 'Standard'),
+        ('no_gap', 'No gap'),
+    ], string='Visit and Patient Numbering',
+        compute='_compute_medical_sequence_implementation',
+        inverse='_inverse_medical_sequence_implementation',
+        help='Standard numbers are drawn from a PostgreSQL sequence: concurrent check-ins and '
+             'imports never wait on each other, but a cancelled transaction leaves a gap. '
+             'No gap numbers lock the sequence until the end of each transaction.')
+
+    def _get_numbering_sequences(self):
+        sequences = self.env['ir.sequence'].sudo()
+        for xmlid in NUMBERING_SEQUENCES:
+            sequences |= self.env.ref(xmlid, raise_if_not_found=False) or sequences
+        return sequences
+
+    @api.depends('company_id')
+    def _compute_medical_sequence_implementation(self):
+        implementation = self._get_numbering_sequences()[:1].implementation or 'standard'
+        for settings in self:
+            settings.medical_sequence_implementation = implementation
+
+    def _inverse_medical_sequence_implementation(self):
+        for settings in self:
+            sequences = self._get_numbering_sequences().filtered(
+                lambda sequence: sequence.implementation != settings.medical_sequence_implementation)
+            sequences.write({'implementation': settings.medical_sequence_implementation})
+
+# vim=expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
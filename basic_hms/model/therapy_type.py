@@ -20,11 +20,55 @@ class therapy_type(models.Model):
     commission_value = fields.Float(string='Commission Value', required=True)
     active = fields.Boolean(string='Active', default=True)
     notes = fields.Text(string='Notes')
+    commission_rate_ids = fields.One2many('therapy.commission.rate', 'therapy_type_id', string='Commission Rates')
 
     _sql_constraints = [
         ('code_uniq', 'unique(code)', 'Therapy Type code must be unique!')
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        # Initial rate, valid since the beginning
+        self.env['therapy.commission.rate'].create([{
+            'therapy_type_id': record.id,
+            'commission_type': record.commission_type,
+            'commission_value': record.commission_value,
+        } for record in records if not record.commission_rate_ids])
+        return records
+
+    def write(self, vals):
+        changed = self.browse()
+        if 'commission_type' in vals or 'commission_value' in vals:
+            changed = self.filtered(lambda record: any(
+                fname in vals and record[fname] != vals[fname] for fname in ('commission_type', 'commission_value')))
+            # Without any rate yet, the previous settings remain valid for
+            # everything before today
+            self.env['therapy.commission.rate'].create([{
+                'therapy_type_id': record.id,
+                'commission_type': record.commission_type,
+                'commission_value': record.commission_value,
+            } for record in changed if not record.commission_rate_ids])
+        res = super().write(vals)
+        changed._version_commission_rate()
+        return res
+
+    def _version_commission_rate(self):
+        """Make the current commission settings the rate valid from today:
+        invoices posted before keep their rate."""
+        today = fields.Date.context_today(self)
+        Rate = self.env['therapy.commission.rate']
+        todays = {rate.therapy_type_id: rate for rate in Rate.search([
+            ('therapy_type_id', 'in', self.ids), ('date_from', '=', today)])}
+        vals_list = []
+        for record in self:
+            vals = {'commission_type': record.commission_type, 'commission_value': record.commission_value}
+            if record in todays:
+                todays[record].write(vals)
+            else:
+                vals_list.append(dict(vals, therapy_type_id=record.id, date_from=today))
+        Rate.create(vals_list)
+
     @api.onchange('commission_type')
     def _onchange_commission_type(self):
         """Reset commission value when commission type changes"""
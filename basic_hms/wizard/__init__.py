@@ -3,5 +3,6 @@
 
 from . import medical_appointments_invoice_wizard
 from . import medical_appointments_therapy_invoice_wizard
+from . import medical_commission_recompute_wizard
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
\ No newline at end of file
@@ -5,10 +5,13 @@ from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
 from datetime import date,datetime
 
+from ..model.medical_action_profile import profiled
+
 class medical_appointments_invoice_wizard(models.TransientModel):
     _name = "medical.appointments.invoice.wizard"
     _description= 'medical appointments invoice wizard'
 
+    @profiled()
     def create_invoice(self):
         active_ids = self._context.get('active_ids')
         list_of_ids  = []
@@ -37,28 +40,11 @@ class medical_appointments_invoice_wizard(models.TransientModel):
                 'journal_id' : sale_journals.id,
                 'ref': lab_req.name,
                 }
+                if not lab_req.consultations_id:
+                    raise UserError(_('No consultation product is set on appointment %s.') % lab_req.name)
+                invoice_line_vals = dict(lab_req.consultations_id._get_medical_invoice_line_template(), quantity=1)
+                invoice_vals['invoice_line_ids'] = [(0, 0, invoice_line_vals)]
                 res = account_invoice_obj.create(invoice_vals)
-                invoice_line_account_id = False
-                if lab_req.consultations_id.id:
-                    invoice_line_account_id = lab_req.consultations_id.property_account_income_id.id or lab_req.consultations_id.categ_id.property_account_income_categ_id.id or False  
-                if not invoice_line_account_id:
-                    raise UserError(
-                        _('There is no income account defined for this product: "%s". You may have to install a chart of account from Accounting app, settings menu.') %
-                        (lab_req.consultations_id.name,))
-
-                tax_ids = []
-                taxes = lab_req.consultations_id.taxes_id.filtered(lambda r: not lab_req.consultations_id.company_id or r.company_id == lab_req.consultations_id.company_id)
-                tax_ids = taxes.ids
-                invoice_line_vals = {
-                    'name': lab_req.consultations_id.name or '',
-                    'account_id': invoice_line_account_id,
-                    'price_unit':lab_req.consultations_id.list_price,
-                    'product_uom_id':lab_req.consultations_id.uom_id.id,
-                    'quantity': 1,
-                    'product_id':lab_req.consultations_id.id,
-                }
-
-                res1 = res.write({'invoice_line_ids' :([(0,0,invoice_line_vals)]) })
 
                 list_of_ids.append(res.id)
                 if list_of_ids:
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Part of BrowseInfo. See LICENSE file for full copyright and licensing details.
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+
+class medical_commission_recompute_wizard(models.TransientModel):
+    _name = 'medical.commission.recompute.wizard'
+    _description = 'Recompute Commissions'
+
+    date_from = fields.Date(string='From', required=True,
+                            default=lambda self: fields.Date.context_today(self).replace(day=1))
+    date_to = fields.Date(string='To', required=True, default=fields.Date.context_today)
+    therapy_type_ids = fields.Many2many('therapy.type', string='Therapy Types',
+                                        help='Leave empty to recompute every therapy type.')
+
+    def action_recompute(self):
+        self.ensure_one()
+        if self.date_from > self.date_to:
+            raise UserError(_('The start date must be before the end date.'))
+        entries = self.env['medical.commission.line']._recompute_period(
+            self.date_from, self.date_to, self.therapy_type_ids or None)
+        action = self.env['ir.actions.act_window']._for_xml_id('basic_hms.action_medical_commission_line')
+        action['domain'] = [('id', 'in', entries.ids)]
+        return action
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,269 @@
+"""Load benchmark of the HMS modules.
+
+Seeds a database with patients, therapy types, appointments, invoices,
+calendar events and DASII assessments, then times the main entry points
+and reports their query counts and durations as JSON.
+
+Run it in an Odoo shell on a database where the modules (and a chart of
+accounts) are installed:
+
+    BENCH_PATIENTS=1000 BENCH_OUTPUT=bench.json odoo-bin shell -d <db> --no-http < benchmarks/hms_benchmark.py
+
+Every entry point runs in a savepoint that is rolled back, so each run sees
+the same data. The seeded data is rolled back at the end as well, unless
+BENCH_KEEP_DATA=1. Entry points of modules that are not installed are
+reported as skipped.
+"""
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+from lxml import etree
+
+from odoo import Command, fields
+
+CONFIG = {
+    'patients': int(os.environ.get('BENCH_PATIENTS', 200)),
+    'appointments_per_patient': int(os.environ.get('BENCH_APPOINTMENTS_PER_PATIENT', 10)),
+    'therapy_types': int(os.environ.get('BENCH_THERAPY_TYPES', 8)),
+    'invoiced_ratio': float(os.environ.get('BENCH_INVOICED_RATIO', 0.5)),
+    'events_per_patient': int(os.environ.get('BENCH_EVENTS_PER_PATIENT', 3)),
+    'assessments': int(os.environ.get('BENCH_ASSESSMENTS', 20)),
+    'wizard_batch': int(os.environ.get('BENCH_WIZARD_BATCH', 100)),
+    'repeat': int(os.environ.get('BENCH_REPEAT', 3)),
+    'random_seed': int(os.environ.get('BENCH_RANDOM_SEED', 42)),
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def is_installed(env, module):
+    return bool(env['ir.module.module'].search_count([('name', '=', module), ('state', '=', 'installed')]))
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def seed(env, rng):
+    """Create the benchmark data and return the records the entry points use."""
+    tag = 'BENCH%s' % int(time.time())
+    today = fields.Date.today()
+    data = {}
+
+    products = env['product.template'].create([{
+        'name': f'{tag} Therapy {index}',
+        'type': 'service',
+        'list_price': rng.choice([300.0, 500.0, 800.0]),
+    } for index in range(CONFIG['therapy_types'])])
+    therapies = env['therapy.type'].create([{
+        'name': f'{tag} Therapy {index}',
+        'code': f'{tag}-{index}',
+        'product_id': product.id,
+        'commission_type': rng.choice(['fixed', 'percentage']),
+        'commission_value': rng.choice([10.0, 15.0, 50.0]),
+    } for index, product in enumerate(products)])
+
+    patients = env['medical.patient'].create([{
+        'patient_name': f'{tag} Patient {index}',
+    } for index in range(CONFIG['patients'])])
+    data['patients'] = patients
+
+    appointments = env['medical.appointment'].with_context(medical_bulk_ingest='benchmark').create([{
+        'patient_id': patient.id,
+        'appointment_date': fields.Datetime.now() - timedelta(days=rng.randint(0, 365), hours=rng.randint(0, 8)),
+        'therapy_ids': [Command.set(rng.sample(therapies.ids, rng.randint(1, min(3, len(therapies)))))],
+        'state': rng.choice(['pending', 'done']),
+    } for patient in patients for _index in range(CONFIG['appointments_per_patient'])])
+    to_invoice = appointments.filtered(lambda appointment: rng.random() < CONFIG['invoiced_ratio'])
+    invoices, _errors = to_invoice._create_therapy_invoices()
+    # Posting fills the commission ledger and the revenue cube, and the
+    # therapy report only reads posted invoices
+    invoices.action_post()
+    data['appointments'] = appointments - to_invoice
+    data['invoices'] = invoices
+
+    if is_installed(env, 'appointment_integration'):
+        now = fields.Datetime.now()
+        event_vals_list = []
+        for patient in patients:
+            for _index in range(CONFIG['events_per_patient']):
+                start = now - timedelta(days=rng.randint(0, 30), hours=rng.randint(1, 8))
+                event_vals_list.append({
+                    'name': f'{tag} Session',
+                    'start': start,
+                    'stop': start + timedelta(hours=1),
+                    'partner_ids': [Command.set(patient.patient_id.ids)],
+                })
+        events = env['calendar.event'].with_context(
+            no_mail_to_attendees=True, mail_create_nolog=True).create(event_vals_list)
+        data['events'] = events
+
+    if is_installed(env, 'dasii_assessment') and CONFIG['assessments']:
+        partners = patients.patient_id
+        assessments = env['dasii.assessment'].create([{
+            'partner_id': partners[index % len(partners)].id,
+            'assessment_date': today,
+            'date_of_birth': today - timedelta(days=rng.randint(60, 900)),
+        } for index in range(CONFIG['assessments'])])
+        for assessment in assessments:
+            for scale in ('motor', 'mental'):
+                passed = rng.randint(5, 60)
+                assessment.set_line_status(scale, None, passed, 'yes')
+                assessment.set_line_status(scale, passed + 1, passed + 15, 'no')
+        data['assessments'] = assessments
+
+    env.flush_all()
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Entry points
+# ---------------------------------------------------------------------------
+
+def bench_patient_list(env, data):
+    Patient = env['medical.patient']
+    arch = etree.fromstring(env.ref('basic_hms.medical_patients_tree_view').arch)
+    specification = {}
+    for node in arch.iter('field'):
+        field = Patient._fields[node.get('name')]
+        specification[field.name] = {'fields': {'display_name': {}}} if field.type == 'many2one' else {}
+    Patient.web_search_read([], specification, limit=80)
+    return 80
+
+
+def bench_create_invoice(env, data):
+    appointment = data['appointments'].filtered('therapy_ids')[:1]
+    appointment.create_invoice()
+    return len(appointment)
+
+
+def bench_therapy_invoice_wizard(env, data):
+    appointments = data['appointments'][:CONFIG['wizard_batch']]
+    wizard = env['medical.appointments.therapy.invoice.wizard'].with_context(active_ids=appointments.ids).create({})
+    wizard.create_therapy_invoice()
+    return len(appointments)
+
+
+def bench_consolidated_invoice(env, data):
+    patient = data['appointments'][:1].patient_id
+    patient.action_create_consolidated_invoice()
+    return len(patient)
+
+
+def bench_consolidated_invoices(env, data):
+    patients = data['appointments'].patient_id[:CONFIG['wizard_batch']]
+    patients.action_create_consolidated_invoices()
+    return len(patients)
+
+
+def bench_calendar_sync(env, data):
+    env['calendar.event']._cron_sync_medical_appointments()
+    return len(data['events'])
+
+
+def bench_xlsx_report(env, data):
+    wizard = env['therapy.report.wizard'].create({
+        'date_start': fields.Date.today() - timedelta(days=365),
+        'date_end': fields.Date.today(),
+    })
+    wizard.action_generate_xlsx_report()
+    return len(data['invoices'])
+
+
+def bench_dasii_scoring(env, data):
+    data['assessments'].action_calculate_score()
+    return len(data['assessments'])
+
+
+ENTRY_POINTS = [
+    # (name, module, function)
+    ('patient_list', 'basic_hms', bench_patient_list),
+    ('create_invoice', 'basic_hms', bench_create_invoice),
+    ('therapy_invoice_wizard', 'basic_hms', bench_therapy_invoice_wizard),
+    ('consolidated_invoice', 'appointment_integration', bench_consolidated_invoice),
+    ('consolidated_invoices', 'appointment_integration', bench_consolidated_invoices),
+    ('calendar_sync', 'appointment_integration', bench_calendar_sync),
+    ('xlsx_report', 'therapy_report_xlsx', bench_xlsx_report),
+    ('dasii_scoring', 'dasii_assessment', bench_dasii_scoring),
+]
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def measure(env, data, name, module, function):
+    result = {'name': name, 'module': module}
+    if not is_installed(env, module):
+        result['skipped'] = 'module not installed'
+        return result
+    timings, queries = [], []
+    try:
+        for _run in range(CONFIG['repeat']):
+            try:
+                with env.cr.savepoint():
+                    env.invalidate_all()
+                    count = env.cr.sql_log_count
+                    start = time.perf_counter()
+                    result['records'] = function(env, data)
+                    env.flush_all()
+                    timings.append(time.perf_counter() - start)
+                    queries.append(env.cr.sql_log_count - count)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result
+    result.update({
+        'runs': len(timings),
+        'queries': max(queries),
+        'seconds': {
+            'min': round(min(timings), 4),
+            'median': round(statistics.median(timings), 4),
+            'max': round(max(timings), 4),
+        },
+    })
+    return result
+
+
+def main(env):
+    rng = random.Random(CONFIG['random_seed'])
+    report = {
+        'database': env.cr.dbname,
+        'date': fields.Datetime.to_string(fields.Datetime.now()),
+        'config': CONFIG,
+    }
+    env.flush_all()
+    env.cr.execute("SAVEPOINT hms_benchmark_seed")
+    try:
+        start = time.perf_counter()
+        data = seed(env, rng)
+        report['seed'] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'records': {key: len(records) for key, records in data.items()},
+        }
+        report['results'] = [measure(env, data, *entry_point) for entry_point in ENTRY_POINTS]
+    finally:
+        if os.environ.get('BENCH_KEEP_DATA') == '1':
+            env.cr.commit()
+        else:
+            env.cr.execute("ROLLBACK TO SAVEPOINT hms_benchmark_seed")
+            env.invalidate_all()
+
+    output = json.dumps(report, indent=2)
+    if os.environ.get('BENCH_OUTPUT'):
+        with open(os.environ['BENCH_OUTPUT'], 'w') as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+main(env)  # noqa: F821 -- provided by odoo-bin shell
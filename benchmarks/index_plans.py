@@ -0,0 +1,155 @@
+"""Query plans of the hot medical.appointment / calendar.event queries,
+without and with the indexes declared by basic_hms and appointment_integration.
+
+Run it in an Odoo shell on a database where both modules are installed:
+
+    BENCH_APPOINTMENTS=1000000 odoo-bin shell -d <db> --no-http < benchmarks/index_plans.py
+
+The data is seeded with plain SQL; everything, seed included, is rolled back
+at the end, so it can be run on a copy of a real database as well.
+"""
+import os
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tools import SQL
+
+APPOINTMENTS = int(os.environ.get('BENCH_APPOINTMENTS', 1000000))
+PATIENTS = int(os.environ.get('BENCH_PATIENTS', max(APPOINTMENTS // 50, 1)))
+EVENTS = int(os.environ.get('BENCH_EVENTS', APPOINTMENTS // 2))
+# Share of the appointments not invoiced yet
+UNINVOICED_RATIO = float(os.environ.get('BENCH_UNINVOICED_RATIO', 0.05))
+
+INDEXES = [
+    'medical_appointment_patient_date_index',
+    'medical_appointment_uninvoiced_patient_index',
+    'medical_appointment__appointment_date_index',
+    'medical_appointment__attendance_date_index',
+    'medical_appointment__invoice_id_index',
+    'calendar_event_medical_unsynced_start_index',
+    'calendar_event_write_date_index',
+]
+
+
+def seed(env):
+    cr = env.cr
+    move = env['account.move'].search([], limit=1) or env['account.move'].create({'move_type': 'entry'})
+    cr.execute("""
+        INSERT INTO medical_patient (patient_name, create_date, write_date)
+        SELECT 'Benchmark patient ' || i, now(), now()
+          FROM generate_series(1, %s) AS i
+        RETURNING id
+    """, [PATIENTS])
+    patient_ids = [row[0] for row in cr.fetchall()]
+    cr.execute("""
+        INSERT INTO medical_appointment (patient_id, appointment_date, attendance_date, state,
+                                         is_invoiced, invoice_id, create_date, write_date)
+        SELECT patient_id, appointment_date, appointment_date::date,
+               CASE WHEN uninvoiced THEN 'pending' ELSE 'done' END,
+               NOT uninvoiced, CASE WHEN uninvoiced THEN NULL ELSE %(move)s END,
+               now(), now()
+          FROM (
+                SELECT (%(patients)s::int[])[1 + (i %% %(patient_count)s)] AS patient_id,
+                       now() - (random() * 1095) * interval '1 day' AS appointment_date,
+                       random() < %(uninvoiced)s AS uninvoiced
+                  FROM generate_series(1, %(count)s) AS i
+               ) AS seed
+    """, {
+        'move': move.id,
+        'patients': patient_ids,
+        'patient_count': len(patient_ids),
+        'uninvoiced': UNINVOICED_RATIO,
+        'count': APPOINTMENTS,
+    })
+    cr.execute("""
+        INSERT INTO calendar_event (name, start, stop, duration, allday, active, privacy, show_as,
+                                    is_computed_as_medical_appointment, create_date, write_date)
+        SELECT 'Benchmark session ' || i, start, start + interval '1 hour', 1.0, false, true,
+               'public', 'busy', start < now() - interval '2 days',
+               start - interval '7 days', start - interval '7 days'
+          FROM (
+                SELECT i, now() - (random() * 1095 - 30) * interval '1 day' AS start
+                  FROM generate_series(1, %s) AS i
+               ) AS seed
+    """, [EVENTS])
+    cr.execute("ANALYZE medical_patient, medical_appointment, calendar_event")
+    return patient_ids
+
+
+def get_queries(env, patient_ids):
+    """Return [(label, SQL)] built the way the modules build them."""
+    Appointment = env['medical.appointment']
+    Event = env['calendar.event']
+    now = fields.Datetime.now()
+    today = fields.Date.today()
+    env.cr.execute("SELECT id FROM medical_appointment WHERE patient_id = ANY(%s) LIMIT 80",
+                   [patient_ids[:80]])
+    appointment_ids = [row[0] for row in env.cr.fetchall()]
+    return [
+        ('previous visit window (80 visits)', SQL("""
+            SELECT id, previous_date
+              FROM (
+                    SELECT id,
+                           LAG(appointment_date) OVER (
+                               PARTITION BY patient_id
+                               ORDER BY appointment_date, id
+                           ) AS previous_date
+                      FROM medical_appointment
+                     WHERE patient_id IN (
+                            SELECT patient_id FROM medical_appointment WHERE id = ANY(%s)
+                     )
+                   ) AS visits
+             WHERE id = ANY(%s)
+        """, appointment_ids, appointment_ids)),
+        ('appointment counts (patient list page)', SQL("""
+            SELECT patient_id, COUNT(*) FROM medical_appointment
+             WHERE patient_id = ANY(%s) GROUP BY patient_id
+        """, patient_ids[:80])),
+        ('consolidated billing (one patient)', Appointment._search([
+            ('patient_id', '=', patient_ids[0]),
+            ('invoice_id', '=', False),
+        ]).select()),
+        ('calendar week (attendance_date)', Appointment._search([
+            ('attendance_date', '>=', today - timedelta(days=7)),
+            ('attendance_date', '<', today),
+        ]).select()),
+        ('unsynced calendar events', Event._search([
+            ('is_computed_as_medical_appointment', '=', False),
+            ('start', '<=', today),
+        ]).select()),
+        ('calendar sync watermark', Event._search([
+            '|', ('write_date', '>', now - timedelta(minutes=20)),
+            '&', ('start', '>', now - timedelta(minutes=20)), ('start', '<=', now),
+        ]).select()),
+    ]
+
+
+def explain(env, queries, title):
+    print('=' * 80)
+    print(title)
+    for label, query in queries:
+        env.cr.execute(SQL("EXPLAIN (ANALYZE, BUFFERS) %s", query))
+        print('-' * 80)
+        print(label)
+        for row in env.cr.fetchall():
+            print('  ' + row[0])
+
+
+def main(env):
+    env.flush_all()
+    env.cr.execute("SAVEPOINT index_plans_seed")
+    try:
+        patient_ids = seed(env)
+        queries = get_queries(env, patient_ids)
+        env.cr.execute("SAVEPOINT index_plans_without")
+        for index in INDEXES:
+            env.cr.execute(SQL("DROP INDEX IF EXISTS %s", SQL.identifier(index)))
+        explain(env, queries, 'Without the indexes')
+        env.cr.execute("ROLLBACK TO SAVEPOINT index_plans_without")
+        explain(env, queries, 'With the indexes')
+    finally:
+        env.cr.execute("ROLLBACK TO SAVEPOINT index_plans_seed")
+        env.invalidate_all()
+
+
+main(env)  # noqa: F821 -- provided by odoo-bin shell
@@ -1,6 +1,20 @@
 from odoo import models, fields, api
+from odoo.tools import SQL, split_every
 from dateutil.relativedelta import relativedelta
 
+from .dasii_scoring import (
+    PERCENTILE_BANDS, bitset_raw_score, ceiling_raw_score, cluster_tallies, curve_value,
+    decode_scale_state, developmental_quotient, encode_scale_state, norm_value, percentile_band,
+    set_bit_status, statuses_to_bitsets,
+)
+
+try:
+    from odoo.addons.basic_hms.model.medical_action_profile import profiled
+except ImportError:
+    # basic_hms is an optional companion: without it nothing is profiled
+    def profiled(action=None):
+        return lambda method: method
+
 class DasiiAssessment(models.Model):
     _name = 'dasii.assessment'
     _description = 'DASII Assessment'
@@ -25,6 +39,21 @@ class DasiiAssessment(models.Model):
     
     motor_dq = fields.Float(string='Motor DQ', readonly=True, help="(DA / Chronological Age) * 100")
     mental_dq = fields.Float(string='Mental DQ', readonly=True, help="(DA / Chronological Age) * 100")
+
+    da_method = fields.Selection([
+        ('item', 'Item Lookup'),
+        ('interpolated', 'Percentile Interpolation'),
+    ], string='DA Method', default='item', required=True,
+        help="Item Lookup: DA is the 50% pass age of the item numbered like the raw score.\n"
+             "Percentile Interpolation: DA is read on the 50% pass-age curve interpolated between items.")
+    age_window_only = fields.Boolean(string='Age-Appropriate Items Only', default=False,
+        help="Only load the items whose 3%-97% pass-age window contains the child's age. "
+             "Items below the window are credited as passed when scoring.")
+    # Compact scoring state used for live rescoring, per scale:
+    # [yes bitset (hex), no bitset (hex), basal credit], bits indexed by item number
+    score_state = fields.Json(string='Scoring State', readonly=True, copy=False)
+    motor_band = fields.Selection(PERCENTILE_BANDS, string='Motor Percentile Band', readonly=True)
+    mental_band = fields.Selection(PERCENTILE_BANDS, string='Mental Percentile Band', readonly=True)
     
     # Corrected Age Fields
     is_premature = fields.Boolean(string='Is Premature?', default=False, readonly=True, tracking=True)
@@ -49,27 +78,84 @@ class DasiiAssessment(models.Model):
             if hasattr(self.partner_id, 'dob'):
                 self.date_of_birth = self.partner_id.dob
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._insert_missing_lines()
+        return records
+
+    @profiled()
     def action_load_items(self):
         """Loads all items into the assessment if not already present."""
         self.ensure_one()
-        # Find all items - Sorted by Scale then Item No
-        # _order is 'scale desc, item_no asc' in dasii.item now
-        all_items = self.env['dasii.item'].search([]) 
-        
-        # Existing items in this assessment
-        existing_item_ids = self.line_ids.mapped('item_id.id')
-        
-        lines_to_create = []
-        for item in all_items:
-            if item.id not in existing_item_ids:
-                lines_to_create.append({
-                    'assessment_id': self.id,
-                    'item_id': item.id,
-                    'item_scale': item.scale,
-                })
-        
-        if lines_to_create:
-            self.env['dasii.assessment.line'].create(lines_to_create)
+        self._insert_missing_lines(age_window=False)
+
+    def _get_items_to_load(self, age_window=None):
+        """Return the norm item ids (ordered by scale and item number) that
+        this assessment should contain."""
+        self.ensure_one()
+        norms = self.env['dasii.item']._get_norm_table()
+        if age_window is None:
+            age_window = self.age_window_only
+        age = self._get_effective_age()
+        item_ids = []
+        for scale in ('motor', 'mental'):
+            scale_norms = norms['scales'].get(scale)
+            if not scale_norms:
+                continue
+            if not age_window or age <= 0:
+                item_ids.extend(scale_norms['ids'])
+                continue
+            item_ids.extend(
+                item_id
+                for item_id, age_3, age_97 in zip(scale_norms['ids'], scale_norms['age_3'], scale_norms['age_97'])
+                if age_3 <= age <= age_97
+            )
+        return item_ids
+
+    def _insert_missing_lines(self, age_window=None):
+        """Create the missing assessment lines of every assessment of self
+        with a single multi-row INSERT.
+
+        Existing lines are diffed as sets, so the method can be called again
+        safely. age_window overrides the age_window_only flag of the records.
+        """
+        if not self:
+            return
+        norms = self.env['dasii.item']._get_norm_table()
+        self.env['dasii.assessment.line'].flush_model(['assessment_id', 'item_id'])
+        self.env.cr.execute("""
+            SELECT assessment_id, item_id
+              FROM dasii_assessment_line
+             WHERE assessment_id = ANY(%s)
+        """, [self.ids])
+        existing = set(self.env.cr.fetchall())
+
+        assessment_ids, item_ids, item_nos, scales = [], [], [], []
+        for record in self:
+            for item_id in record._get_items_to_load(age_window):
+                if (record.id, item_id) in existing:
+                    continue
+                scale, index = norms['positions'][item_id]
+                assessment_ids.append(record.id)
+                item_ids.append(item_id)
+                item_nos.append(norms['scales'][scale]['item_nos'][index])
+                scales.append(scale)
+        if not item_ids:
+            return
+
+        self.env.cr.execute("""
+            INSERT INTO dasii_assessment_line
+                   (assessment_id, item_id, item_no, item_scale, is_selected,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT line.assessment_id, line.item_id, line.item_no, line.item_scale, FALSE,
+                   %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC'
+              FROM UNNEST(%s::int[], %s::int[], %s::int[], %s::varchar[])
+                   AS line(assessment_id, item_id, item_no, item_scale)
+        """, [self.env.uid, self.env.uid, assessment_ids, item_ids, item_nos, scales])
+        self.invalidate_recordset(['line_ids'])
+        # the line set changed: the next rescore must be a full one
+        self.filtered('score_state').write({'score_state': False})
 
     def _calculate_scale_score(self, scale):
         """
@@ -82,95 +168,284 @@ class DasiiAssessment(models.Model):
         """
         self.ensure_one()
         lines = self.line_ids.filtered(lambda l: l.item_scale == scale).sorted('item_no')
-        
-        raw_score = 0
-        consecutive_no = 0
-        
-        for line in lines:
-            if line.status == 'yes':
-                raw_score += 1
-                consecutive_no = 0 # Reset on Yes
-            elif line.status == 'no':
-                consecutive_no += 1
-            
-            # Stop condition
-            if consecutive_no >= 10:
-                break
-                
-        return raw_score
+        return ceiling_raw_score(lines.mapped('status'))
+
+    def _get_effective_age(self):
+        """Corrected age when available and greater than 0, chronological age otherwise."""
+        self.ensure_one()
+        if self.is_premature and self.corrected_age_months > 0:
+            return self.corrected_age_months
+        return self.age_months
+
+    def _read_line_statuses(self):
+        """Fetch the lines of every assessment of self with a single query.
+
+        Returns {assessment_id: {scale: (has_line, statuses)}} where both lists
+        are aligned on the items of the cached norm table.
+        """
+        if not self:
+            return {}
+        norms = self.env['dasii.item']._get_norm_table()
+        self.env['dasii.assessment.line'].flush_model(['assessment_id', 'item_id', 'status'])
+        self.env.cr.execute("""
+            SELECT assessment_id, item_id, status
+              FROM dasii_assessment_line
+             WHERE assessment_id = ANY(%s)
+        """, [self.ids])
+        result = {}
+        for assessment_id, item_id, status in self.env.cr.fetchall():
+            position = norms['positions'].get(item_id)
+            if position is None:
+                continue
+            scale, index = position
+            scales = result.setdefault(assessment_id, {})
+            if scale not in scales:
+                size = len(norms['scales'][scale]['ids'])
+                scales[scale] = ([False] * size, [None] * size)
+            has_line, statuses = scales[scale]
+            has_line[index] = True
+            statuses[index] = status
+        return result
 
+    def _get_scores(self):
+        """Score every assessment of self in one pass.
+
+        Returns {assessment_id: (score vals, {cluster_id: [total_items, yes_count, band]})}.
+        """
+        norms = self.env['dasii.item']._get_norm_table()
+        line_statuses = self._read_line_statuses()
+        results = {}
+        for record in self:
+            effective_age = record._get_effective_age()
+            vals = {}
+            clusters = {}
+            state = {}
+            for scale in ('motor', 'mental'):
+                scale_norms = norms['scales'].get(scale)
+                has_line, statuses = line_statuses.get(record.id, {}).get(scale, ((), ()))
+                basal = 0
+                if scale_norms:
+                    statuses = [status for status, present in zip(statuses, has_line) if present]
+                    cluster_ids = [cluster_id for cluster_id, present in zip(scale_norms['cluster_ids'], has_line) if present]
+                    item_nos = [item_no for item_no, present in zip(scale_norms['item_nos'], has_line) if present]
+                    # Items below the first loaded one count as passed when
+                    # only the age-appropriate items were loaded
+                    if record.age_window_only and True in has_line:
+                        basal = has_line.index(True)
+                    state[scale] = encode_scale_state(*statuses_to_bitsets(item_nos, statuses), basal)
+                else:
+                    statuses, cluster_ids = [], []
+                raw_score = ceiling_raw_score(['yes'] * basal + statuses)
+                vals.update(record._get_scale_score_vals(scale, scale_norms, raw_score, effective_age))
+                clusters.update(cluster_tallies(cluster_ids, statuses))
+            for cluster_id, tally in clusters.items():
+                tally.append(record._get_cluster_band(norms, cluster_id, tally[1], effective_age))
+            vals['score_state'] = state
+            results[record.id] = (vals, clusters)
+        return results
+
+    def _get_scale_score_vals(self, scale, scale_norms, raw_score, effective_age):
+        """Return raw score, DA, DQ and percentile band vals of one scale."""
+        self.ensure_one()
+        if not scale_norms:
+            da, band = 0.0, False
+        else:
+            if self.da_method == 'interpolated':
+                da = curve_value(scale_norms['curve_50'], raw_score)
+            else:
+                # DA is the 50% pass age of the item numbered like the raw score
+                da = norm_value(scale_norms, 'age_50', raw_score)
+            band = percentile_band(
+                effective_age,
+                curve_value(scale_norms['curve_3'], raw_score),
+                curve_value(scale_norms['curve_50'], raw_score),
+                curve_value(scale_norms['curve_97'], raw_score),
+            )
+        return {
+            '%s_raw_score' % scale: raw_score,
+            '%s_da' % scale: da,
+            '%s_dq' % scale: developmental_quotient(da, effective_age),
+            '%s_band' % scale: band,
+        }
+
+    @api.model
+    def _get_cluster_band(self, norms, cluster_id, yes_count, effective_age):
+        """Percentile band of the last item reached in a cluster."""
+        curves = norms['cluster_curves'].get(cluster_id)
+        if not curves or not yes_count:
+            return False
+        index = min(yes_count, len(curves[0])) - 1
+        return percentile_band(effective_age, curves[0][index], curves[1][index], curves[2][index])
+
+    def _write_cluster_scores(self, cluster_results):
+        """Update the cluster score rows in place.
+
+        cluster_results maps assessment ids to
+        {cluster_id: [total_items, yes_count, band]}; rows are only written
+        when their values change.
+        """
+        ClusterScore = self.env['dasii.cluster.score']
+        existing = {
+            (score.assessment_id.id, score.cluster_id.id): score
+            for score in ClusterScore.search([('assessment_id', 'in', list(cluster_results))])
+        }
+        to_create = []
+        for assessment_id, clusters in cluster_results.items():
+            for cluster_id, (total_items, yes_count, band) in clusters.items():
+                if not total_items:
+                    continue
+                vals = {'total_items': total_items, 'yes_count': yes_count, 'band': band}
+                score = existing.pop((assessment_id, cluster_id), None)
+                if score is None:
+                    to_create.append(dict(vals, assessment_id=assessment_id, cluster_id=cluster_id))
+                elif (score.total_items, score.yes_count, score.band) != (total_items, yes_count, band):
+                    score.write(vals)
+        if existing:
+            ClusterScore.browse([score.id for score in existing.values()]).unlink()
+        if to_create:
+            ClusterScore.create(to_create)
+
+    @profiled()
     def action_calculate_score(self):
         """Calculates the cluster scores and Final DQ based on PASS (Yes) answers."""
+        results = self._get_scores()
         for record in self:
-            # 1. Cluster Scores
-            # Clear existing scores
-            record.cluster_score_ids.unlink()
-            
-            # Find all relevant clusters
-            clusters = self.env['dasii.cluster'].search([])
-            
-            score_vals = []
-            for cluster in clusters:
-                # Find lines associated with items in this cluster
-                cluster_lines = record.line_ids.filtered(lambda l: l.item_id.cluster_id == cluster)
-                
-                total_items = len(cluster_lines)
-                # Note: Cluster score is simple YES count, doesn't mention ceiling rule 
-                # but usually cluster count is derived from effective items. 
-                # For now keeping it simple count as originally requested.
-                yes_count = len(cluster_lines.filtered(lambda l: l.status == 'yes'))
-                
-                if total_items > 0:
-                    score_vals.append({
-                        'assessment_id': record.id,
-                        'cluster_id': cluster.id,
-                        'total_items': total_items,
-                        'yes_count': yes_count,
-                    })
-            
-            if score_vals:
-                self.env['dasii.cluster.score'].create(score_vals)
-
-            # 2. Final DQ Scoring
-            motor_score = record._calculate_scale_score('motor')
-            mental_score = record._calculate_scale_score('mental')
-            
-            record.motor_raw_score = motor_score
-            record.mental_raw_score = mental_score
-            
-            # Determine DA (Developmental Age)
-            # Find item with item_no == raw_score
-            motor_da_item = self.env['dasii.item'].search([('scale', '=', 'motor'), ('item_no', '=', motor_score)], limit=1)
-            mental_da_item = self.env['dasii.item'].search([('scale', '=', 'mental'), ('item_no', '=', mental_score)], limit=1)
-            
-            record.motor_da = motor_da_item.age_50 if motor_da_item else 0.0
-            record.mental_da = mental_da_item.age_50 if mental_da_item else 0.0
-            
-            # Calculate DQ
-            # Use corrected age if available and greater than 0
-            effective_age = record.corrected_age_months if record.is_premature and record.corrected_age_months > 0 else record.age_months
-            
-            if effective_age > 0:
-                record.motor_dq = (record.motor_da / effective_age) * 100
-                record.mental_dq = (record.mental_da / effective_age) * 100
-            else:
-                record.motor_dq = 0.0
-                record.mental_dq = 0.0
+            record.write(results[record.id][0])
+        self._write_cluster_scores({
+            assessment_id: clusters for assessment_id, (vals, clusters) in results.items()
+        })
+
+    @api.model
+    def _rescore_all(self, batch_size=500):
+        """Re-score every assessment, e.g. after a correction of the norm table."""
+        for ids in split_every(batch_size, self.search([]).ids):
+            self.browse(ids).action_calculate_score()
+            self.env.invalidate_all()
 
+    @profiled()
     def action_bulk_mark_yes(self):
         """Marks selected lines as Yes and unchecks them."""
-        for record in self:
-            selected_lines = record.line_ids.filtered(lambda l: l.is_selected)
-            if selected_lines:
-                selected_lines.write({'status': 'yes', 'is_selected': False})
+        self._update_line_status('yes', [('is_selected', '=', True)], clear_selection=True)
 
+    @profiled()
     def action_bulk_mark_no(self):
         """Marks selected lines as No and unchecks them."""
+        self._update_line_status('no', [('is_selected', '=', True)], clear_selection=True)
+
+    @profiled()
+    def set_line_status(self, scale, item_no_from, item_no_to, status):
+        """Set the status of the lines of a scale within an item number range.
+
+        Bounds are inclusive and may be None for an open range; status is
+        'yes', 'no' or False to clear. The lines are updated with a single
+        UPDATE and the assessments are re-scored.
+        """
+        domain = [('item_scale', '=', scale)]
+        if item_no_from is not None:
+            domain.append(('item_no', '>=', item_no_from))
+        if item_no_to is not None:
+            domain.append(('item_no', '<=', item_no_to))
+        self._update_line_status(status, domain)
+        return True
+
+    def _update_line_status(self, status, domain, clear_selection=False):
+        """Set status of the lines of self matching domain, in one UPDATE, then
+        re-score the assessments touched. With clear_selection, the lines are
+        also unchecked; otherwise the user's selection is left alone."""
+        if not self:
+            return
+        self.check_access('write')
+        Line = self.env['dasii.assessment.line']
+        Line.flush_model(['assessment_id', 'item_no', 'item_scale', 'is_selected', 'status'])
+        where = Line._where_calc(domain + [('assessment_id', 'in', self.ids)])
+        self.env.cr.execute(SQL("""
+            WITH previous AS (
+                SELECT id, status
+                  FROM dasii_assessment_line
+                 WHERE %s
+                   FOR UPDATE
+            )
+            UPDATE dasii_assessment_line line
+               SET status = %s%s,
+                   write_uid = %s, write_date = NOW() AT TIME ZONE 'UTC'
+              FROM previous
+             WHERE line.id = previous.id
+         RETURNING line.id, line.assessment_id, line.item_id, previous.status
+        """, where.where_clause, status or None,
+            SQL(", is_selected = FALSE") if clear_selection else SQL(),
+            self.env.uid))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return
+        Line.browse([row[0] for row in rows]).invalidate_recordset(['status', 'is_selected', 'write_uid', 'write_date'])
+        changes = {}
+        for _line_id, assessment_id, item_id, previous_status in rows:
+            changes.setdefault(assessment_id, []).append((item_id, previous_status, status or None))
+        self.browse(changes)._rescore_after_line_change(changes)
+
+    def _rescore_after_line_change(self, changes):
+        """Bring the scores of self up to date after line statuses changed.
+
+        changes maps assessment ids to [(item_id, old status, new status)].
+        Only the bitsets, ceiling run and DA/DQ of the affected scales and
+        the tallies of the affected clusters are recomputed; assessments
+        without a scoring state yet are fully scored instead.
+        """
+        norms = self.env['dasii.item']._get_norm_table()
+        full = self.browse()
+        cluster_deltas = {}
         for record in self:
-            selected_lines = record.line_ids.filtered(lambda l: l.is_selected)
-            if selected_lines:
-                selected_lines.write({'status': 'no', 'is_selected': False})
+            state = dict(record.score_state or {})
+            scale_changes = {}
+            for item_id, old_status, new_status in changes.get(record.id, ()):
+                old_status, new_status = old_status or None, new_status or None
+                position = norms['positions'].get(item_id)
+                if position is None or old_status == new_status:
+                    continue
+                scale_changes.setdefault(position[0], []).append((position[1], old_status, new_status))
+            if not scale_changes:
+                continue
+            if any(scale not in state for scale in scale_changes):
+                full |= record
+                continue
+
+            effective_age = record._get_effective_age()
+            vals = {}
+            for scale, scale_items in scale_changes.items():
+                scale_norms = norms['scales'][scale]
+                yes_bits, no_bits, basal = decode_scale_state(state[scale])
+                for index, old_status, new_status in scale_items:
+                    yes_bits, no_bits = set_bit_status(yes_bits, no_bits, scale_norms['item_nos'][index], new_status)
+                    cluster_id = scale_norms['cluster_ids'][index]
+                    delta = (new_status == 'yes') - (old_status == 'yes')
+                    if cluster_id and delta:
+                        key = (record.id, cluster_id)
+                        cluster_deltas[key] = cluster_deltas.get(key, 0) + delta
+                state[scale] = encode_scale_state(yes_bits, no_bits, basal)
+                raw_score = bitset_raw_score(yes_bits, no_bits, basal)
+                vals.update(record._get_scale_score_vals(scale, scale_norms, raw_score, effective_age))
+            vals['score_state'] = state
+            record.write(vals)
 
+        if cluster_deltas:
+            scores = self.env['dasii.cluster.score'].search([
+                ('assessment_id', 'in', list({key[0] for key in cluster_deltas})),
+                ('cluster_id', 'in', list({key[1] for key in cluster_deltas})),
+            ])
+            scores_by_key = {(score.assessment_id.id, score.cluster_id.id): score for score in scores}
+            for (assessment_id, cluster_id), delta in cluster_deltas.items():
+                score = scores_by_key.get((assessment_id, cluster_id))
+                if score is None:
+                    full |= self.browse(assessment_id)
+                    continue
+                yes_count = score.yes_count + delta
+                score.write({
+                    'yes_count': yes_count,
+                    'band': self._get_cluster_band(
+                        norms, cluster_id, yes_count, score.assessment_id._get_effective_age()),
+                })
+        if full:
+            full.action_calculate_score()
 
 class DasiiAssessmentLine(models.Model):
     _name = 'dasii.assessment.line'
@@ -194,6 +469,30 @@ class DasiiAssessmentLine(models.Model):
     
     comments = fields.Text()
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.assessment_id.filtered('score_state').write({'score_state': False})
+        return lines
+
+    def write(self, vals):
+        if 'status' not in vals:
+            return super().write(vals)
+        previous = {line.id: (line.assessment_id.id, line.item_id.id, line.status) for line in self}
+        res = super().write(vals)
+        changes = {}
+        for line in self:
+            assessment_id, item_id, old_status = previous[line.id]
+            changes.setdefault(assessment_id, []).append((item_id, old_status, line.status))
+        self.env['dasii.assessment'].browse(changes)._rescore_after_line_change(changes)
+        return res
+
+    def unlink(self):
+        assessments = self.assessment_id
+        res = super().unlink()
+        assessments.exists().filtered('score_state').write({'score_state': False})
+        return res
+
     def action_mark_yes(self):
         self.status = 'yes'
 
@@ -203,15 +502,9 @@ class DasiiAssessmentLine(models.Model):
     def action_mark_above_yes(self):
         """Marks current line and all previous lines in same scale as Yes."""
         for record in self:
-            lines_to_update = record.assessment_id.line_ids.filtered(
-                lambda l: l.item_scale == record.item_scale and l.item_no <= record.item_no
-            )
-            lines_to_update.write({'status': 'yes'})
+            record.assessment_id.set_line_status(record.item_scale, None, record.item_no, 'yes')
 
     def action_mark_above_no(self):
         """Marks current line and all previous lines in same scale as No."""
         for record in self:
-            lines_to_update = record.assessment_id.line_ids.filtered(
-                lambda l: l.item_scale == record.item_scale and l.item_no <= record.item_no
-            )
-            lines_to_update.write({'status': 'no'})
+            record.assessment_id.set_line_status(record.item_scale, None, record.item_no, 'no')
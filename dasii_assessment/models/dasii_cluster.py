@@ -1,4 +1,4 @@
-from odoo import models, fields
+from odoo import models, fields, api
 
 class DasiiCluster(models.Model):
     _name = 'dasii.cluster'
@@ -13,3 +13,20 @@ class DasiiCluster(models.Model):
     ], required=True, string='Scale Type')
     sequence = fields.Integer(default=10)
     item_ids = fields.One2many('dasii.item', 'cluster_id', string='Items')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        # the norm table cached on dasii.item embeds the clusters
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
@@ -1,5 +1,7 @@
 from odoo import models, fields
 
+from .dasii_scoring import PERCENTILE_BANDS
+
 class DasiiClusterScore(models.Model):
     _name = 'dasii.cluster.score'
     _description = 'DASII Cluster Score'
@@ -13,3 +15,4 @@ class DasiiClusterScore(models.Model):
     
     total_items = fields.Integer(string='Total')
     yes_count = fields.Integer(string='RESULT')
+    band = fields.Selection(PERCENTILE_BANDS, string='Percentile Band')
@@ -1,4 +1,6 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+
+from .dasii_scoring import build_curve
 
 class DasiiItem(models.Model):
     _name = 'dasii.item'
@@ -22,3 +24,84 @@ class DasiiItem(models.Model):
     _sql_constraints = [
         ('item_scale_uniq', 'unique(item_no, scale)', 'Item number must be unique per scale!'),
     ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_norm_table(self):
+        """Return the DASII norm table as plain, read-only data.
+
+        The table is static reference data, so it is cached for the whole
+        process and only invalidated when an item or a cluster changes::
+
+            {
+                'scales': {scale: {'ids', 'item_nos', 'cluster_ids',
+                                   'age_3', 'age_50', 'age_97',  # tuples ordered by item_no
+                                   'curve_3', 'curve_50', 'curve_97'}},  # indexed by raw score
+                'positions': {item_id: (scale, index in the scale tuples)},
+                'clusters': {cluster_id: {'scale', 'code', 'name', 'sequence'}},
+                'cluster_curves': {cluster_id: (ages_3, ages_50, ages_97)},  # indexed by yes count - 1
+            }
+
+        The curves are the lookup arrays used for percentile interpolation;
+        they are computed once here rather than for every assessment.
+
+        Callers must not modify the returned structures.
+        """
+        items = self.sudo().search_read(
+            [], ['scale', 'item_no', 'cluster_id', 'age_3', 'age_50', 'age_97'],
+            order='scale, item_no')
+        columns = {}
+        positions = {}
+        for item in items:
+            scale = columns.setdefault(item['scale'], {
+                'ids': [], 'item_nos': [], 'cluster_ids': [], 'age_3': [], 'age_50': [], 'age_97': [],
+            })
+            positions[item['id']] = (item['scale'], len(scale['ids']))
+            scale['ids'].append(item['id'])
+            scale['item_nos'].append(item['item_no'])
+            scale['cluster_ids'].append(item['cluster_id'] and item['cluster_id'][0])
+            scale['age_3'].append(item['age_3'])
+            scale['age_50'].append(item['age_50'])
+            scale['age_97'].append(item['age_97'])
+        clusters = self.env['dasii.cluster'].sudo().search_read([], ['scale', 'code', 'name', 'sequence'])
+        scales = {}
+        cluster_ages = {}
+        for scale, scale_columns in columns.items():
+            scale_norms = {key: tuple(values) for key, values in scale_columns.items()}
+            for column in ('age_3', 'age_50', 'age_97'):
+                scale_norms['curve_%s' % column[4:]] = build_curve(scale_norms['item_nos'], scale_norms[column])
+            scales[scale] = scale_norms
+            for index, cluster_id in enumerate(scale_norms['cluster_ids']):
+                if cluster_id:
+                    ages = cluster_ages.setdefault(cluster_id, ([], [], []))
+                    ages[0].append(scale_norms['age_3'][index])
+                    ages[1].append(scale_norms['age_50'][index])
+                    ages[2].append(scale_norms['age_97'][index])
+        return {
+            'scales': scales,
+            'positions': positions,
+            'clusters': {
+                cluster['id']: {key: cluster[key] for key in ('scale', 'code', 'name', 'sequence')}
+                for cluster in clusters
+            },
+            'cluster_curves': {
+                cluster_id: tuple(tuple(column) for column in ages)
+                for cluster_id, ages in cluster_ages.items()
+            },
+        }
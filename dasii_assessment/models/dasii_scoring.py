@@ -0,0 +1,170 @@
+"""Pure scoring helpers shared by the DASII models.
+
+These functions work on plain Python sequences (no records), so a whole
+batch of assessments can be scored from the rows of a single query.
+"""
+
+from bisect import bisect_left
+
+# Testing of a scale stops after this many consecutive failed items
+CEILING_RUN = 10
+
+
+def ceiling_raw_score(statuses):
+    """Return the raw score of one scale.
+
+    statuses holds the line status ('yes', 'no' or None) of every item of
+    the scale, ordered by item number. Passed items are counted until
+    CEILING_RUN consecutive failures are met; unanswered items neither count
+    nor break a run of failures.
+    """
+    raw_score = 0
+    consecutive_no = 0
+    for status in statuses:
+        if status == 'yes':
+            raw_score += 1
+            consecutive_no = 0
+        elif status == 'no':
+            consecutive_no += 1
+            if consecutive_no >= CEILING_RUN:
+                break
+    return raw_score
+
+
+def cluster_tallies(cluster_ids, statuses):
+    """Return {cluster_id: [total_items, yes_count]} for the given lines.
+
+    cluster_ids and statuses are parallel sequences, one entry per line.
+    """
+    tallies = {}
+    for cluster_id, status in zip(cluster_ids, statuses):
+        if not cluster_id:
+            continue
+        tally = tallies.setdefault(cluster_id, [0, 0])
+        tally[0] += 1
+        if status == 'yes':
+            tally[1] += 1
+    return tallies
+
+
+def developmental_quotient(da, age):
+    """Return DA / age * 100, or 0.0 when the age is unknown."""
+    return (da / age) * 100 if age > 0 else 0.0
+
+
+def norm_value(scale_norms, column, item_no):
+    """Return the norm column value of the item numbered item_no, 0.0 if none.
+
+    scale_norms is one scale of the cached norm table (tuples ordered by
+    item_no).
+    """
+    item_nos = scale_norms['item_nos']
+    index = bisect_left(item_nos, item_no)
+    if index < len(item_nos) and item_nos[index] == item_no:
+        return scale_norms[column][index] or 0.0
+    return 0.0
+
+
+PERCENTILE_BANDS = [
+    ('below_3', 'Below 3rd percentile'),
+    ('3_50', '3rd - 50th percentile'),
+    ('50_97', '50th - 97th percentile'),
+    ('above_97', 'Above 97th percentile'),
+]
+
+
+def build_curve(item_nos, ages):
+    """Return a pass-age curve indexed by raw score (0 .. last item number).
+
+    Ages are linearly interpolated between numbered items, starting from
+    age 0 at raw score 0, and made non-decreasing so a higher score never
+    maps to a younger age.
+    """
+    if not item_nos:
+        return ()
+    curve = [0.0] * (item_nos[-1] + 1)
+    points = [(0, 0.0)] + [(item_no, age or 0.0) for item_no, age in zip(item_nos, ages)]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        for x in range(x0, x1 + 1):
+            curve[x] = y0 + (y1 - y0) * (x - x0) / (x1 - x0) if x1 != x0 else y1
+    for x in range(1, len(curve)):
+        curve[x] = max(curve[x], curve[x - 1])
+    return tuple(curve)
+
+
+def curve_value(curve, raw_score):
+    """Return the curve value at raw_score, clamped to the curve bounds."""
+    if not curve:
+        return 0.0
+    return curve[max(0, min(raw_score, len(curve) - 1))]
+
+
+def percentile_band(age, age_3, age_50, age_97):
+    """Return the PERCENTILE_BANDS key of a child of the given age who
+    reaches an item with the given 3%/50%/97% pass ages."""
+    if age <= 0 or not age_97:
+        return False
+    if age < age_3:
+        return 'above_97'
+    if age < age_50:
+        return '50_97'
+    if age <= age_97:
+        return '3_50'
+    return 'below_3'
+
+
+# Incremental scoring keeps, per scale, two bitsets indexed by item number:
+# the items answered 'yes' and the items answered 'no'.
+
+def statuses_to_bitsets(item_nos, statuses):
+    """Return the (yes_bits, no_bits) of the given parallel sequences."""
+    yes_bits = no_bits = 0
+    for item_no, status in zip(item_nos, statuses):
+        if status == 'yes':
+            yes_bits |= 1 << item_no
+        elif status == 'no':
+            no_bits |= 1 << item_no
+    return yes_bits, no_bits
+
+
+def set_bit_status(yes_bits, no_bits, item_no, status):
+    """Return the bitsets updated with the new status of one item."""
+    mask = 1 << item_no
+    yes_bits &= ~mask
+    no_bits &= ~mask
+    if status == 'yes':
+        yes_bits |= mask
+    elif status == 'no':
+        no_bits |= mask
+    return yes_bits, no_bits
+
+
+def bitset_raw_score(yes_bits, no_bits, basal=0):
+    """Same rule as ceiling_raw_score, walking only the answered items.
+
+    basal items are credited as passed before the first answered item.
+    """
+    raw_score = basal
+    consecutive_no = 0
+    answered = yes_bits | no_bits
+    while answered:
+        lowest = answered & -answered
+        if yes_bits & lowest:
+            raw_score += 1
+            consecutive_no = 0
+        else:
+            consecutive_no += 1
+            if consecutive_no >= CEILING_RUN:
+                break
+        answered ^= lowest
+    return raw_score
+
+
+def encode_scale_state(yes_bits, no_bits, basal):
+    """Serialize the state of one scale for a Json field."""
+    return ['%x' % yes_bits, '%x' % no_bits, basal]
+
+
+def decode_scale_state(state):
+    """Inverse of encode_scale_state."""
+    return int(state[0], 16), int(state[1], 16), state[2]
@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
 # Part of Synapse Clinic. See LICENSE file for full copyright and licensing details.
 
-import base64
-import io
+import itertools
+import os
+import tempfile
+from datetime import timedelta
+
 import xlsxwriter
-from collections import defaultdict
+from xlsxwriter.utility import xl_range
 
 from odoo import _, fields, models
 from odoo.exceptions import UserError
 
+from odoo.addons.basic_hms.model.medical_action_profile import profiled
+
 
 class TherapyReportWizard(models.TransientModel):
     _name = 'therapy.report.wizard'
@@ -18,23 +23,81 @@ class TherapyReportWizard(models.TransientModel):
     date_end = fields.Date(string="End Date", default=fields.Date.context_today)
     therapy_type_ids = fields.Many2many('therapy.type', string="Therapy Types", 
                                        help="Leave empty to include all therapy types")
-    generated_xlsx_file = fields.Binary(string="Generated XLSX Report")
+    use_formulas = fields.Boolean(string="Totals as Formulas",
+                                  help="Write the totals row as SUM formulas instead of plain values")
 
-    def action_generate_xlsx_report(self):
-        """Generate XLSX report with therapy data and commission calculations"""
-        
-        # Build domain for medical appointments
-        domain = [('state', '!=', 'cancelled')]
+    def _get_report_rows(self, therapy_types):
+        """Yield one (partner name, invoice number, appointment date, therapy data)
+        tuple per posted invoice, therapy data mapping therapy.type ids to their total
+        value and commission.
+
+        Totals are aggregated per invoice and therapy type by a single grouped
+        query, read in batches through a server-side cursor: only one batch of
+        rows is held in memory at a time.
+        """
+        self.env['medical.appointment'].flush_model(['appointment_date', 'invoice_id'])
+        self.env['account.move'].flush_model(['name', 'partner_id', 'state'])
+        self.env['account.move.line'].flush_model(['move_id', 'therapy_type_id', 'price_subtotal'])
+        self.env['medical.commission.line'].flush_model(['move_line_id', 'commission'])
+
+        where = ["apt.invoice_id IS NOT NULL"]
+        params = []
         if self.date_start:
-            domain += [('appointment_date', '>=', self.date_start)]
+            where.append("apt.appointment_date >= %s")
+            params.append(self.date_start)
         if self.date_end:
-            domain += [('appointment_date', '<=', self.date_end)]
+            # The end date is a day: include all of it
+            where.append("apt.appointment_date < %s")
+            params.append(self.date_end + timedelta(days=1))
+        params.append(therapy_types.ids)
+
+        cursor_name = 'therapy_report_rows_%s' % self.id
+        self.env.cr.execute("""
+            DECLARE %s NO SCROLL CURSOR FOR
+            WITH invoiced AS (
+                SELECT apt.invoice_id, MAX(apt.appointment_date) AS appointment_date
+                  FROM medical_appointment apt
+                 WHERE %s
+              GROUP BY apt.invoice_id
+            )
+            SELECT move.id, partner.name, move.name, invoiced.appointment_date,
+                   line.therapy_type_id,
+                   SUM(line.price_subtotal) AS total_value,
+                   SUM(COALESCE(commission.commission, 0.0)) AS commission
+              FROM invoiced
+              JOIN account_move move ON move.id = invoiced.invoice_id
+         LEFT JOIN res_partner partner ON partner.id = move.partner_id
+              JOIN account_move_line line ON line.move_id = move.id
+                                         AND line.therapy_type_id IS NOT NULL
+         LEFT JOIN medical_commission_line commission ON commission.move_line_id = line.id
+             WHERE move.state = 'posted'
+               AND line.therapy_type_id = ANY(%%s)
+          GROUP BY move.id, partner.name, move.name, invoiced.appointment_date, line.therapy_type_id
+          ORDER BY invoiced.appointment_date DESC, move.id
+        """ % (cursor_name, " AND ".join(where)), params)
 
-        # Get all medical appointments in the date range
-        appointments = self.env['medical.appointment'].sudo().search(domain, order='appointment_date DESC')
+        current = None
+        while True:
+            # The declared cursor lives until the end of the transaction, so
+            # other queries may run between two batches
+            self.env.cr.execute("FETCH 1000 FROM %s" % cursor_name)
+            rows = self.env.cr.fetchall()
+            if not rows:
+                self.env.cr.execute("CLOSE %s" % cursor_name)
+                break
+            for move_id, partner_name, move_name, appointment_date, therapy_id, total_value, commission in rows:
+                if current is None or current[0] != move_id:
+                    if current is not None:
+                        yield current[1:]
+                    current = (move_id, partner_name or '', move_name or '',
+                               appointment_date and appointment_date.date(), {})
+                current[4][therapy_id] = {'total_value': total_value or 0.0, 'commission': commission or 0.0}
+        if current is not None:
+            yield current[1:]
 
-        if not appointments:
-            raise UserError(_("No appointment records were found for the specified date range."))
+    @profiled()
+    def action_generate_xlsx_report(self):
+        """Generate XLSX report with therapy data and commission calculations"""
 
         # Get all therapy types (either selected or all)
         if self.therapy_type_ids:
@@ -45,17 +108,46 @@ class TherapyReportWizard(models.TransientModel):
         if not therapy_types:
             raise UserError(_("No therapy types found. Please configure therapy types first."))
 
-        # Get all invoices related to these appointments
-        invoice_ids = appointments.mapped('invoice_id').filtered(lambda inv: inv.state in ['posted', 'draft'])
-        
-        if not invoice_ids:
-            raise UserError(_("No invoices found for the appointments in the specified date range."))
+        # Rows are read lazily, in batches
+        therapy_types.mapped('name')
+        rows = self._get_report_rows(therapy_types)
+        first_row = next(rows, None)
+        if first_row is None:
+            raise UserError(_("No posted invoices found for the appointments in the specified date range."))
+
+        # Rows are flushed to a temporary file as soon as they are written. The
+        # finished file is then read back whole to be stored as an attachment,
+        # so memory still grows with the size of the XLSX file (not with the
+        # number of rows queried)
+        fd, file_path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+            worksheet = workbook.add_worksheet('Therapy Report')
+            self._write_xlsx_report(workbook, worksheet, therapy_types, first_row, rows)
+            workbook.close()
+            with open(file_path, 'rb') as report_file:
+                data = report_file.read()
+        finally:
+            os.unlink(file_path)
 
-        # Create Excel workbook
-        output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output)
-        worksheet = workbook.add_worksheet('Therapy Report')
+        filename = f'Therapy Report {fields.Date.today().strftime("%d-%b-%Y")}.xlsx'
+        attachment = self.env['ir.attachment'].create({
+            'name': filename,
+            'raw': data,
+            'res_model': self._name,
+            'res_id': self.id,
+            'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        })
 
+        return {
+            "type": "ir.actions.act_url",
+            "target": "self",
+            "url": "/web/content/%s?download=true" % attachment.id,
+        }
+
+    def _write_xlsx_report(self, workbook, worksheet, therapy_types, first_row, rows):
+        """Write the report rows, in order, to the given worksheet"""
         # Define formats
         bold = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter'})
         header_format = workbook.add_format({
@@ -76,6 +168,9 @@ class TherapyReportWizard(models.TransientModel):
             'align': 'right'
         })
 
+        # Commissions are booked in the ledger when invoices are posted
+        worksheet.set_header('&L%s' % _('Posted invoices only'))
+
         # Set column widths
         worksheet.set_column(0, 0, 25)  # Invoice Partner
         worksheet.set_column(1, 1, 15)  # Invoice Number
@@ -122,54 +217,32 @@ class TherapyReportWizard(models.TransientModel):
         # Process data and write to Excel
         row = 2
         total_commission = 0.0
+        # Running totals of the therapy columns (total value, commission, ...)
+        column_totals = [0.0] * (2 * len(therapy_types))
         
-        for invoice in invoice_ids:
-            # Get invoice lines with therapy data
-            invoice_lines = invoice.invoice_line_ids.filtered(lambda line: line.therapy_type_id)
-            
-            if not invoice_lines:
-                continue
-            
-            # Group invoice lines by therapy type
-            therapy_data = defaultdict(lambda: {'total_value': 0.0, 'commission': 0.0})
-            
-            for line in invoice_lines:
-                if line.therapy_type_id in therapy_types:
-                    therapy_data[line.therapy_type_id]['total_value'] += line.price_subtotal
-                    therapy_data[line.therapy_type_id]['commission'] += line.commission or 0.0
-            
+        for partner_name, invoice_name, appointment_date, therapy_data in itertools.chain([first_row], rows):
             # Calculate row commission total
             row_commission = sum(data['commission'] for data in therapy_data.values())
             total_commission += row_commission
             
             # Write invoice basic info
-            worksheet.write(row, 0, invoice.partner_id.name or '')
-            worksheet.write(row, 1, invoice.name or '')
-            
-            # Handle appointment_date (might be datetime or date)
-            appointment_date = None
-            if invoice.invoice_line_ids:
-                # Get the first appointment related to this invoice
-                first_appointment = appointments.filtered(lambda apt: apt.invoice_id == invoice)[:1]
-                if first_appointment and first_appointment.appointment_date:
-                    if hasattr(first_appointment.appointment_date, 'date'):
-                        appointment_date = first_appointment.appointment_date.date()
-                    else:
-                        appointment_date = first_appointment.appointment_date
-            
+            worksheet.write(row, 0, partner_name)
+            worksheet.write(row, 1, invoice_name)
             worksheet.write(row, 2, appointment_date or '', date_format)
             
             # Write therapy data
             col = 3
             for therapy in therapy_types:
-                data = therapy_data.get(therapy, {'total_value': 0.0, 'commission': 0.0})
+                data = therapy_data.get(therapy.id, {'total_value': 0.0, 'commission': 0.0})
                 
                 # Total Value column
                 worksheet.write(row, col, data['total_value'], currency_format)
+                column_totals[col - 3] += data['total_value']
                 col += 1
                 
                 # Commission column
                 worksheet.write(row, col, data['commission'], currency_format)
+                column_totals[col - 3] += data['commission']
                 col += 1
             
             # Write row commission total
@@ -186,28 +259,12 @@ class TherapyReportWizard(models.TransientModel):
             worksheet.write(summary_row, 1, '', bold)
             worksheet.write(summary_row, 2, '', bold)
             
-            # Calculate and write therapy totals
-            col = 3
-            for therapy in therapy_types:
-                # Calculate column totals
-                col_total = 0.0
-                col_commission = 0.0
-                
-                for data_row in range(2, row):
-                    try:
-                        col_total += worksheet.read(data_row, col) or 0.0
-                        col_commission += worksheet.read(data_row, col + 1) or 0.0
-                    except:
-                        pass  # Handle any read errors
-                
-                # Write totals
-                worksheet.write(summary_row, col, col_total, total_format)
-                col += 1
-                worksheet.write(summary_row, col, col_commission, total_format)
-                col += 1
+            # Write therapy totals from the running accumulators
+            for offset, col_total in enumerate(column_totals):
+                self._write_total(worksheet, summary_row, 3 + offset, col_total, total_format)
             
             # Write grand total commission
-            worksheet.write(summary_row, col, total_commission, total_format)
+            self._write_total(worksheet, summary_row, 3 + len(column_totals), total_commission, total_format)
 
         # Add filters info
         info_row = summary_row + 2 if row > 2 else row + 2
@@ -217,21 +274,10 @@ class TherapyReportWizard(models.TransientModel):
             therapy_names = ', '.join(self.therapy_type_ids.mapped('name'))
             worksheet.write(info_row + 2, 0, f'Therapy Types: {therapy_names}', bold)
 
-        workbook.close()
-        output.seek(0)
-
-        # Store the generated file
-        self.generated_xlsx_file = base64.b64encode(output.getvalue())
-
-        return {
-            "type": "ir.actions.act_url",
-            "target": "self",
-            "url": "/web/content?model=therapy.report.wizard"
-                   "&field=generated_xlsx_file"
-                   "&download=true"
-                   "&filename={filename}"
-                   "&id={record_id}".format(
-                       filename=f'Therapy Report {fields.Date.today().strftime("%d-%b-%Y")}.xlsx',
-                       record_id=self.id
-                   ),
-        }
+    def _write_total(self, worksheet, row, col, value, cell_format):
+        """Write a totals cell, as a SUM over the data rows when requested.
+        The accumulated value is kept as the formula's cached result."""
+        if self.use_formulas:
+            worksheet.write_formula(row, col, '=SUM(%s)' % xl_range(2, col, row - 1, col), cell_format, value)
+        else:
+            worksheet.write(row, col, value, cell_format)